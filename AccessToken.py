@@ -1,12 +1,14 @@
 # token生成代码来自 https://www.volcengine.com/docs/6348/70121
 # 其它语言可以通过上面的链接获取
 import base64
+import binascii
 import hmac
 import random
 import struct
+import threading
 import time
-from hashlib import sha256
 from collections import OrderedDict
+from hashlib import sha256
 
 VERSION = "001"
 VERSION_LENGTH = 3
@@ -22,6 +24,15 @@ privPublishDataStream = 3
 
 PrivSubscribeStream = 4
 
+SIGNATURE_LENGTH = 32
+
+_uint16_struct = struct.Struct('<H')
+_msg_header_struct = struct.Struct('<III')
+_privilege_struct = struct.Struct('<HI')
+
+# nonce generator for mint_tokens, seeded once instead of per token
+_mint_random = random.Random()
+
 class AccessToken:
     # Initializes token struct by required parameters.
     def __init__(self, app_id, app_key, room_id, user_id):
@@ -52,19 +63,13 @@ class AccessToken:
         self.expire_at = expire_ts
 
     def pack_msg(self):
-        m = pack_uint32(self.nonce)
-        m += pack_uint32(self.issued_at)
-        m += pack_uint32(self.expire_at)
-        m += pack_string(self.room_id)
-        m += pack_string(self.user_id)
-        m += pack_map_uint32(self.privileges)
-        return m
+        return pack_token_msg(self.nonce, self.issued_at, self.expire_at, self.room_id, self.user_id, self.privileges)
 
     # Serialize generates the token string
     def serialize(self):
-        m = self.pack_msg()
-        signature = hmac.new(self.app_key.encode('utf-8'), m, sha256).digest()
-        content = pack_bytes(m) + pack_bytes(signature)
+        keyed_hmac = hmac.new(self.app_key.encode('utf-8'), None, sha256)
+        content = pack_token_content(keyed_hmac, self.nonce, self.issued_at, self.expire_at,
+                                     self.room_id.encode('utf-8'), self.user_id.encode('utf-8'), sorted_privileges(self.privileges))
 
         return VERSION + self.app_id + base64.b64encode(content).decode('utf-8')
 
@@ -76,6 +81,32 @@ class AccessToken:
         self.app_key = key
         return hmac.new(self.app_key.encode('utf-8'), self.pack_msg(), sha256).digest() == self.signature
 
+# MintTokens issues one token string per (room_id, user_id) pair, in order.
+# The app key HMAC state is keyed once and copied per token, and nonces come from
+# a single generator seeded once, so the cost per token is packing plus hashing.
+def mint_tokens(app_id, app_key, pairs, expire_ts, privileges=(PrivPublishStream, PrivSubscribeStream), issued_at=None):
+    if issued_at is None:
+        issued_at = int(time.time())
+
+    privilege_map = {}
+    for privilege in privileges:
+        privilege_map[privilege] = expire_ts
+        if privilege == PrivPublishStream:
+            privilege_map[privPublishVideoStream] = expire_ts
+            privilege_map[privPublishAudioStream] = expire_ts
+            privilege_map[privPublishDataStream] = expire_ts
+
+    privilege_items = sorted_privileges(privilege_map)
+    keyed_hmac = hmac.new(app_key.encode('utf-8'), None, sha256)
+    prefix = VERSION + app_id
+    randint = _mint_random.randint
+    tokens = []
+    for room_id, user_id in pairs:
+        content = pack_token_content(keyed_hmac, randint(1, 99999999), issued_at, expire_ts,
+                                     room_id.encode('utf-8'), user_id.encode('utf-8'), privilege_items)
+        tokens.append(prefix + base64.b64encode(content).decode('utf-8'))
+    return tokens
+
 # Parse retrieves token information from raw string
 def parse(raw):
     try:
@@ -107,6 +138,175 @@ def parse(raw):
         return
 
 
+# parse_token_view parses a raw token with struct.unpack_from over a memoryview of the
+# decoded content, without per-field slicing. Returns (token, msg) where msg is the
+# signed message view, or None if the token is malformed.
+def parse_token_view(raw):
+    if len(raw) <= VERSION_LENGTH + APP_ID_LENGTH or raw[:VERSION_LENGTH] != VERSION:
+        return None
+    try:
+        encoded = raw[VERSION_LENGTH + APP_ID_LENGTH:]
+        content = base64.b64decode(encoded, validate=True)
+        # b64decode 会接受多余的 '=' 和非零的填充位，只接受与重新编码结果完全一致的 token
+        if base64.b64encode(content).decode('ascii') != encoded:
+            return None
+        view = memoryview(content)
+        msg_len = _uint16_struct.unpack_from(view, 0)[0]
+        msg = view[2:2 + msg_len]
+        signature_len = _uint16_struct.unpack_from(view, 2 + msg_len)[0]
+        signature = view[4 + msg_len:4 + msg_len + signature_len]
+        if len(msg) != msg_len or 4 + msg_len + signature_len != len(view):
+            return None
+
+        nonce, issued_at, expire_at = _msg_header_struct.unpack_from(msg, 0)
+        offset = _msg_header_struct.size
+        strings = []
+        for _ in range(2):
+            strlen = _uint16_struct.unpack_from(msg, offset)[0]
+            offset += 2
+            if offset + strlen > msg_len:
+                return None
+            strings.append(str(msg[offset:offset + strlen], 'utf-8'))
+            offset += strlen
+        privileges = {}
+        maplen = _uint16_struct.unpack_from(msg, offset)[0]
+        offset += 2
+        for _ in range(maplen):
+            key, value = _privilege_struct.unpack_from(msg, offset)
+            privileges[key] = value
+            offset += _privilege_struct.size
+    except (binascii.Error, ValueError, struct.error):
+        return None
+
+    # skip __init__, it reseeds random and reads the clock
+    token = AccessToken.__new__(AccessToken)
+    token.app_id = raw[VERSION_LENGTH:VERSION_LENGTH + APP_ID_LENGTH]
+    token.app_key = ""
+    token.nonce = nonce
+    token.issued_at = issued_at
+    token.expire_at = expire_at
+    token.room_id = strings[0]
+    token.user_id = strings[1]
+    token.privileges = privileges
+    token.signature = bytes(signature)
+    return (token, msg)
+
+
+# TokenVerifier validates tokens presented by devices, called by server side.
+# Verified tokens are kept in an LRU cache keyed by the raw string, so a device that
+# reconnects with the same token is neither re-parsed nor re-hashed. Cached entries
+# are dropped once the token expires.
+class TokenVerifier:
+    def __init__(self, app_id, app_key, max_entries=4096):
+        self.app_id = app_id
+        self.max_entries = max_entries
+        self._keyed_hmac = hmac.new(app_key.encode('utf-8'), None, sha256)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits" : 0,
+            "misses" : 0,
+            "rejected" : 0,
+            "expired" : 0,
+        }
+
+    # Verify returns the parsed AccessToken if raw is valid, otherwise None.
+    def verify(self, raw, now=None):
+        if now is None:
+            now = int(time.time())
+
+        with self._lock:
+            token = self._cache.get(raw)
+            if token is not None:
+                if 0 < token.expire_at < now:
+                    del self._cache[raw]
+                    self.stats["expired"] += 1
+                    return None
+                self._cache.move_to_end(raw)
+                self.stats["hits"] += 1
+                return token
+            self.stats["misses"] += 1
+
+        parsed = parse_token_view(raw)
+        if parsed is None:
+            return self._reject()
+        token, msg = parsed
+        if token.app_id != self.app_id or 0 < token.expire_at < now:
+            return self._reject()
+        signature = self._keyed_hmac.copy()
+        signature.update(msg)
+        if not hmac.compare_digest(signature.digest(), token.signature):
+            return self._reject()
+
+        with self._lock:
+            self._cache[raw] = token
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return token
+
+    # PurgeExpired drops every cached token that has expired by now.
+    def purge_expired(self, now=None):
+        if now is None:
+            now = int(time.time())
+        with self._lock:
+            for raw in [raw for raw, token in self._cache.items() if 0 < token.expire_at < now]:
+                del self._cache[raw]
+
+    def _reject(self):
+        with self._lock:
+            self.stats["rejected"] += 1
+        return None
+
+
+# Token serialization packs into one preallocated buffer whose size is known up front,
+# producing the same bytes as concatenating pack_uint32/pack_string/pack_map_uint32.
+def sorted_privileges(privileges):
+    return sorted((int(k), int(v)) for k, v in privileges.items())
+
+
+def token_msg_size(room_bytes, user_bytes, privilege_items):
+    return _msg_header_struct.size + 2 + len(room_bytes) + 2 + len(user_bytes) + 2 + _privilege_struct.size * len(privilege_items)
+
+
+def pack_token_msg_into(buf, offset, nonce, issued_at, expire_at, room_bytes, user_bytes, privilege_items):
+    _msg_header_struct.pack_into(buf, offset, int(nonce), int(issued_at), int(expire_at))
+    offset += _msg_header_struct.size
+    for b in (room_bytes, user_bytes):
+        _uint16_struct.pack_into(buf, offset, len(b))
+        offset += 2
+        buf[offset:offset + len(b)] = b
+        offset += len(b)
+    _uint16_struct.pack_into(buf, offset, len(privilege_items))
+    offset += 2
+    for k, v in privilege_items:
+        _privilege_struct.pack_into(buf, offset, k, v)
+        offset += _privilege_struct.size
+    return offset
+
+
+def pack_token_msg(nonce, issued_at, expire_at, room_id, user_id, privileges):
+    room_bytes = room_id.encode('utf-8')
+    user_bytes = user_id.encode('utf-8')
+    privilege_items = sorted_privileges(privileges)
+    buf = bytearray(token_msg_size(room_bytes, user_bytes, privilege_items))
+    pack_token_msg_into(buf, 0, nonce, issued_at, expire_at, room_bytes, user_bytes, privilege_items)
+    return bytes(buf)
+
+
+# Packs pack_bytes(msg) + pack_bytes(signature) in place; keyed_hmac is copied, not consumed.
+def pack_token_content(keyed_hmac, nonce, issued_at, expire_at, room_bytes, user_bytes, privilege_items):
+    msg_size = token_msg_size(room_bytes, user_bytes, privilege_items)
+    buf = bytearray(2 + msg_size + 2 + SIGNATURE_LENGTH)
+    _uint16_struct.pack_into(buf, 0, msg_size)
+    end = pack_token_msg_into(buf, 2, nonce, issued_at, expire_at, room_bytes, user_bytes, privilege_items)
+    signature = keyed_hmac.copy()
+    with memoryview(buf) as view:
+        signature.update(view[2:end])
+    _uint16_struct.pack_into(buf, end, SIGNATURE_LENGTH)
+    buf[end + 2:] = signature.digest()
+    return buf
+
+
 def pack_uint16(x):
     return struct.pack('<H', int(x))
 
@@ -128,13 +328,14 @@ def pack_bytes(b):
 
 
 def pack_map_uint32(m):
-    m = OrderedDict(sorted(m.items(), key=lambda x: int(x[0])))
-
-    ret = pack_uint16(len(m.items()))
-
-    for k, v in m.items():
-        ret += pack_uint16(k) + pack_uint32(v)
-    return ret
+    items = sorted_privileges(m)
+    buf = bytearray(2 + _privilege_struct.size * len(items))
+    _uint16_struct.pack_into(buf, 0, len(items))
+    offset = 2
+    for k, v in items:
+        _privilege_struct.pack_into(buf, offset, k, v)
+        offset += _privilege_struct.size
+    return bytes(buf)
 
 
 class ReadByteBuffer:
@@ -1,26 +1,190 @@
 import http.server
-import socketserver
+import io
 import json
+import os
 import uuid
 import time
 
 import AccessToken
 import RtcApiRequester
+import RtcAigcServer
+import RtcAigcSupervisor
+import RtcSessionRegistry
+import RtcRequestCoalescer
+import RtcVoiceChatTemplate
+import RtcMetrics
+import RtcLog
+import RtcRetry
+import RtcCircuitBreaker
+import RtcPriorityGate
+import RtcToolDispatcher
+import RtcToolCache
+import RtcCredentialPool
+import RtcStopQueue
+import RtcSessionReaper
+import RtcRateLimiter
 
 from RtcAigcConfig import *
 
 RESPONSE_CODE_SUCCESS = 200
+RESPONSE_CODE_ACCEPTED = 202
 RESPONSE_CODE_REQUEST_ERROR = 400
+RESPONSE_CODE_NOT_FOUND = 404
+RESPONSE_CODE_REQUEST_TIMEOUT = 408
+RESPONSE_CODE_LENGTH_REQUIRED = 411
+RESPONSE_CODE_PAYLOAD_TOO_LARGE = 413
+RESPONSE_CODE_UNSUPPORTED_MEDIA_TYPE = 415
+RESPONSE_CODE_TOO_MANY_REQUESTS = 429
 RESPONSE_CODE_SERVER_ERROR = 500
 # START_VOICE_CHAT_URL = "https://rtc.volcengineapi.com?Action=StartVoiceChat&Version=2024-06-01"
 # STOP_VOICE_CHAT_URL = "https://rtc.volcengineapi.com?Action=StopVoiceChat&Version=2024-06-01"
 # UPDATE_VOICE_CHAT_URL = "https://rtc.volcengineapi.com?Action=UpdateVoiceChat&Version=2024-06-01"
-RTC_API_HOST = "rtc.volcengineapi.com"
 RTC_API_START_VOICE_CHAT_ACTION = "StartVoiceChat"
 RTC_API_STOP_VOICE_CHAT_ACTION = "StopVoiceChat"
 RTC_API_UPDATE_VOICE_CHAT_ACTION = "UpdateVoiceChat"
 RTC_API_VERSION = "2024-06-01"
 
+# 指标中的 path 标签只取这些值，其它路径记为 "other"，避免标签数量不受控制
+METRICS_PATHS = ("/startvoicechat", "/stopvoicechat", "/updatevoicechat")
+
+
+# 上游临时错误按指数退避重试，所有请求共享重试预算
+rtc_api_retry = RtcRetry.RetryPolicy(RTC_API_RETRY_MAX_ATTEMPTS, RTC_API_RETRY_BASE_DELAY, RTC_API_RETRY_MAX_DELAY, RTC_API_RETRY_DEADLINE,
+                                     RtcRetry.RetryBudget(RTC_API_RETRY_BUDGET_RATIO, RTC_API_RETRY_BUDGET_MIN_PER_SECOND, RTC_API_RETRY_BUDGET_CAPACITY))
+
+
+# 每个 action 一个熔断器，上游持续失败时直接返回错误，不占用工作线程等待超时
+rtc_api_breakers = RtcCircuitBreaker.CircuitBreakers(failure_ratio=RTC_API_CIRCUIT_FAILURE_RATIO, min_requests=RTC_API_CIRCUIT_MIN_REQUESTS,
+                                                     window=RTC_API_CIRCUIT_WINDOW, open_duration=RTC_API_CIRCUIT_OPEN_DURATION,
+                                                     half_open_probes=RTC_API_CIRCUIT_HALF_OPEN_PROBES)
+RtcCircuitBreaker.register_metrics(rtc_api_breakers)
+
+
+# 上游并发闸门，名额不够时打断请求优先
+rtc_api_gate = RtcPriorityGate.PriorityGate(RTC_API_MAX_CONCURRENT)
+RtcMetrics.registry.gauge("rtc_aigc_upstream_gate", "Upstream requests in flight and waiting for a slot.", ("state",),
+                          lambda: [(("in_flight",), rtc_api_gate.in_flight()), (("waiting",), rtc_api_gate.waiting), (("timeouts",), rtc_api_gate.timeouts)])
+
+# 打断请求只在很短的截止时间内快速重试一次，与其它请求共享重试预算
+interrupt_retry = RtcRetry.RetryPolicy(2, 0.01, 0.05, INTERRUPT_DEADLINE, rtc_api_retry.budget)
+# StartVoiceChat 不是幂等的，读超时或 5xx 后重试可能启动重复的智能体，只重试连接失败和 429
+start_retry = RtcRetry.RetryPolicy(RTC_API_RETRY_MAX_ATTEMPTS, RTC_API_RETRY_BASE_DELAY, RTC_API_RETRY_MAX_DELAY, RTC_API_RETRY_DEADLINE,
+                                   rtc_api_retry.budget, RtcRetry.NON_IDEMPOTENT_RETRYABLE_STATUS, RtcRetry.NON_IDEMPOTENT_RETRYABLE_ERRORS)
+# 打断请求从收到到回复设备的耗时
+interrupt_seconds = RtcMetrics.registry.histogram("rtc_aigc_interrupt_seconds", "Time from receiving an interrupt to answering the device.",
+                                                  buckets=(0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.3, 0.5, 1.0))
+interrupt_slo_violations_total = RtcMetrics.registry.counter("rtc_aigc_interrupt_slo_violations_total", "Interrupts answered slower than INTERRUPT_SLO_SECONDS.")
+
+
+# function calling 工具，按函数名注册，相同参数的结果按工具的 cache_ttl 缓存
+tool_result_cache = RtcToolCache.ToolResultCache(TOOL_CACHE_MAX_ENTRIES)
+tool_dispatcher = RtcToolDispatcher.ToolDispatcher(TOOL_WORKERS, TOOL_TIMEOUT, tool_result_cache)
+RtcMetrics.registry.gauge("rtc_aigc_tool_cache_entries", "Entries in the tool result cache.", (), lambda: [((), len(tool_result_cache))])
+
+# 下面工具只是示例，要根据实际情况，解析参数，做出真实的响应
+@tool_dispatcher.tool("get_current_weather", cache_ttl=600)
+def get_current_weather(arguments):
+    return "今天天气很好，阳光明媚，偶尔有微风。"
+
+
+# 调用 RTC OpenAPI，返回 (code, response)。熔断、排队超时或重试后仍然连接失败时 code 为 None，错误信息放在 response 中
+def call_rtc_api(action, request_body_str, priority=RtcPriorityGate.PRIORITY_DEFAULT, retry=rtc_api_retry):
+    canonical_query_string = "Action=%s&Version=%s" % (action, RTC_API_VERSION)
+    # timeout 为剩余的截止时间，排队等待和上游请求的连接、读取都不超过它
+    request = lambda timeout: RtcApiRequester.request_rtc_api(RTC_API_HOST, "POST", "/", canonical_query_string, None, request_body_str, AK, SK, timeout)
+    if RTC_API_CIRCUIT_BREAKER_ENABLED:
+        breaker = rtc_api_breakers.get(action)
+        unguarded_request = request
+        request = lambda timeout: breaker.call(lambda: unguarded_request(timeout), lambda result: result[0] in RtcRetry.RETRYABLE_STATUS)
+    # 每次尝试单独占用名额，退避等待期间不占用
+    ungated_request = request
+    def request(timeout):
+        deadline_at = time.monotonic() + timeout
+        with rtc_api_gate.slot(priority, timeout):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("rtc api deadline exceeded")
+            return ungated_request(remaining)
+    try:
+        return retry.call(request, action)
+    except (RtcCircuitBreaker.CircuitOpenError, RtcPriorityGate.GateTimeoutError) as e:
+        return (None, {"ResponseMetadata" : {"Error" : {"Message" : str(e)}}})
+    except RtcRetry.RETRYABLE_ERRORS as e:
+        RtcLog.warning("rtc_api_error", action=action, error=repr(e))
+        return (None, {"ResponseMetadata" : {"Error" : {"Message" : "request rtc api failed: " + str(e)}}})
+
+
+# 上游返回成功记为 info(可采样)，其它情况记为 warning
+def log_rtc_api_response(action, code, response):
+    if code == RESPONSE_CODE_SUCCESS and response != None and response.get("Result") == "ok":
+        RtcLog.info("rtc_api_response", action=action, code=code, response=response)
+    else:
+        RtcLog.warning("rtc_api_response", action=action, code=code, response=response)
+
+# 调用 StopVoiceChat，成功返回 None，否则返回错误信息
+def request_stop_voice_chat(json_obj):
+    # 参考 https://www.volcengine.com/docs/6348/1316244
+    request_body = {
+        "AppId" : json_obj["app_id"],      # rtc app id
+        "RoomId" : json_obj["room_id"],    # rtc 房间 id
+        "UserId" : json_obj["uid"]         # rtc 客户端用户id
+    }
+
+    request_body_str = json.dumps(request_body)
+    code, response = call_rtc_api(RTC_API_STOP_VOICE_CHAT_ACTION, request_body_str)
+    log_rtc_api_response(RTC_API_STOP_VOICE_CHAT_ACTION, code, response)
+    if code == RESPONSE_CODE_SUCCESS:
+        if "Result" in response and response["Result"] == "ok":
+            return None
+        else:
+            return response["ResponseMetadata"]["Error"]["Message"]
+    else:
+        if response != None:
+            return response["ResponseMetadata"]["Error"]["Message"]
+        else:
+            return "request rtc api response code " + str(code)
+    return None
+
+# 后台 stop 队列，按房间去重，匀速调用上游
+stop_queue = RtcStopQueue.StopQueue(request_stop_voice_chat, STOP_QUEUE_WORKERS, STOP_QUEUE_RATE, STOP_QUEUE_MAX_ATTEMPTS,
+                                    STOP_QUEUE_RETRY_DELAY, STOP_QUEUE_MAX_PENDING)
+RtcMetrics.registry.gauge("rtc_aigc_stop_queue_pending", "Stops waiting in the background stop queue.", (), lambda: [((), stop_queue.pending())])
+
+# 按设备和按 app_id 限流，在签名和请求上游之前拒绝
+device_rate_limiter = RtcRateLimiter.RateLimiter(RATE_LIMIT_DEVICE_RATE, RATE_LIMIT_DEVICE_BURST, RATE_LIMIT_MAX_KEYS)
+app_rate_limiter = RtcRateLimiter.RateLimiter(RATE_LIMIT_APP_RATE, RATE_LIMIT_APP_BURST, RATE_LIMIT_MAX_KEYS)
+rate_limited_total = RtcMetrics.registry.counter("rtc_aigc_rate_limited_total", "Requests rejected with 429 by scope (device / app).", ("scope",))
+
+# 通过本服务启动的会话，过期时间与 token 有效期一致
+session_registry = RtcSessionRegistry.SessionRegistry(TOKEN_EXPIRE_SECONDS)
+# 同一设备或同一 Idempotency-Key 的 start 请求合并为一次上游调用
+start_coalescer = RtcRequestCoalescer.RequestCoalescer(START_IDEMPOTENCY_WINDOW)
+
+# 按设备合并 start 的幂等 key，同一设备换了 (bot_id, voice_id) 时不合并
+def device_idempotency_key(device_id, profile):
+    return "device:" + json.dumps([device_id, profile])
+
+# 停止会话的智能体(空闲回收或同一设备换了 bot_id / voice_id)，会话已经从注册表中删除
+def stop_session(session):
+    if session.device_id != None:
+        start_coalescer.forget(device_idempotency_key(session.device_id, session.profile))
+    payload = {
+        "app_id" : session.app_id,
+        "room_id" : session.room_id,
+        "uid" : session.uid
+    }
+    if stop_queue.submit(session.room_id, payload):
+        return
+    request_stop_voice_chat(payload)
+
+session_reaper = RtcSessionReaper.SessionReaper(session_registry, stop_session, SESSION_IDLE_TIMEOUT, SESSION_REAPER_INTERVAL)
+# 预生成的房间凭证，start 时直接取用
+credential_pool = RtcCredentialPool.CredentialPool(RTC_APP_ID, RTC_APP_KEY, TOKEN_EXPIRE_SECONDS, CREDENTIAL_POOL_LOW_WATERMARK,
+                                                   CREDENTIAL_POOL_HIGH_WATERMARK, CREDENTIAL_POOL_MAX_AGE)
+RtcMetrics.registry.gauge("rtc_aigc_credential_pool_size", "Pre-minted room credentials ready for use.", (), lambda: [((), credential_pool.size())])
+# StartVoiceChat 请求体模板，按 (bot_id, voice_id) 缓存
+start_voice_chat_templates = RtcVoiceChatTemplate.StartVoiceChatTemplates(START_TEMPLATE_MAX_PROFILES)
+
 
 class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
     '''
@@ -71,8 +235,51 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
 
     '''
 
+    # 响应头和响应体分两次写出，关闭 Nagle 避免与客户端延迟 ACK 叠加出约 40ms 的停顿
+    disable_nagle_algorithm = True
+    # 连接读写超时，读取请求时按 handle_one_request 设置的截止时间缩短
+    timeout = REQUEST_TIMEOUT
+
+    # rfile 换成按截止时间读取的版本，原来的 makefile 要关闭，否则 socket 关闭时 fd 不会释放
+    def setup(self):
+        http.server.BaseHTTPRequestHandler.setup(self)
+        self.rfile.close()
+        self.request_reader = RtcAigcServer.DeadlineSocketReader(self.connection)
+        self.rfile = io.BufferedReader(self.request_reader)
+
+    # 请求行、请求头和请求体共用一个截止时间，慢客户端每次只发一个字节也不能一直占用工作线程
+    def handle_one_request(self):
+        self.request_reader.deadline = time.monotonic() + REQUEST_TIMEOUT
+        http.server.BaseHTTPRequestHandler.handle_one_request(self)
+
     def do_POST(self):
-        json_obj = self.parse_post_data()
+        self.request_started = time.perf_counter()
+        RtcMetrics.set_path(self.path if self.path in METRICS_PATHS else "other")
+        with RtcMetrics.span("total"):
+            self.handle_post()
+
+    def do_GET(self):
+        if METRICS_ENABLED and self.path == "/metrics":
+            data = RtcMetrics.render().encode()
+            self.send_response(RESPONSE_CODE_SUCCESS)
+            self.send_header('Content-type', RtcMetrics.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.response_data(RESPONSE_CODE_NOT_FOUND, "path error, unknown path: " + self.path)
+
+    # BaseHTTPRequestHandler 默认同步写 stderr，改为结构化日志
+    def log_message(self, format, *args):
+        RtcLog.info("access", client=self.address_string(), message=format % args)
+
+    # 错误的请求行、send_error 等默认也走 log_message，单独记为 warning，不参与采样
+    def log_error(self, format, *args):
+        RtcLog.warning("http_error", client=self.address_string(), message=format % args)
+
+    def handle_post(self):
+        with RtcMetrics.span("parse_post_data"):
+            json_obj = self.parse_post_data()
         if json_obj == None:
             return
         
@@ -83,44 +290,95 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         elif self.path == "/updatevoicechat":
             self.update_voice_chat(json_obj)
         else:
-            self.response_data(404, "path error, unknown path: " + self.path)
+            self.response_data(RESPONSE_CODE_NOT_FOUND, "path error, unknown path: " + self.path)
             return
 
 ###################################### start voice chat ######################################
     def start_voice_chat(self, json_obj):
-        room_info = self.generate_rtc_room_info(json_obj)
+        device_id = self.get_device_id(json_obj)
+        profile = self.get_start_profile(json_obj)
+        if SESSION_REGISTRY_ENABLED and device_id != None:
+            # 同一设备以相同的 bot_id、voice_id 已有进行中的会话，直接返回，不再重复创建房间和智能体
+            session = session_registry.get_by_device(device_id)
+            if session != None and session.profile == profile:
+                session_registry.touch(session.room_id)
+                resp_obj = {
+                    "data" : session.room_info()
+                }
+                self.response_data(RESPONSE_CODE_SUCCESS, "", resp_obj)
+                return
+            # 换了 bot_id 或 voice_id，先停止旧会话的智能体再创建新会话；并发的 start 只有一个能删除成功
+            if session != None and session_registry.remove(session.room_id) is session:
+                stop_session(session)
+
+        # 设备因为网络问题重试时，进行中或刚完成的 start 结果直接共享，不重复创建房间和智能体
+        idempotency_key = self.get_idempotency_key(device_id, profile)
+        if idempotency_key != None:
+            (code, msg, resp_obj), _ = start_coalescer.do(idempotency_key, lambda: self.create_voice_chat(json_obj, device_id, profile),
+                                                         lambda result: result[0] == RESPONSE_CODE_SUCCESS)
+        else:
+            code, msg, resp_obj = self.create_voice_chat(json_obj, device_id, profile)
+        self.response_data(code, msg, resp_obj)
+
+    # 创建房间并启动智能体，返回 (code, msg, resp_obj)
+    def create_voice_chat(self, json_obj, device_id, profile):
+        with RtcMetrics.span("generate_rtc_room_info"):
+            room_info, expire_time = self.generate_rtc_room_info(json_obj)
         ret = self.request_start_voice_chat(room_info, json_obj)
         if ret == None:
+            if SESSION_REGISTRY_ENABLED:
+                session_registry.add(room_info, device_id, expire_time, profile=profile)
             resp_obj = {
                 "data" : room_info
             }
-            self.response_data(RESPONSE_CODE_SUCCESS, "", resp_obj)
+            return (RESPONSE_CODE_SUCCESS, "", resp_obj)
         else:
-            self.response_data(RESPONSE_CODE_SERVER_ERROR, ret)
+            return (RESPONSE_CODE_SERVER_ERROR, ret, None)
+
+    # 幂等 key，优先取 header Idempotency-Key，其次使用设备标识和 (bot_id, voice_id)
+    def get_idempotency_key(self, device_id, profile):
+        if not START_IDEMPOTENCY_ENABLED:
+            return None
+        key = self.headers.get("Idempotency-Key")
+        if key != None and key != "":
+            return "key:" + key
+        # stop 时要通过注册表找到设备清除合并结果，否则同一设备 stop 后再 start 会拿到已经停止的房间
+        if SESSION_REGISTRY_ENABLED and device_id != None:
+            return device_idempotency_key(device_id, profile)
+        return None
     
+    # 返回 (room_info, token 过期时间)
     def generate_rtc_room_info(self, json_obj):
         # 根据业务情况，生成 room_id，用户id 或者 从客户端请求中获取
-        # 这里简单生成一个随机的 room_id 和 user_id
+        # 这里简单生成一个随机的 room_id 和 user_id，默认从预生成的凭证池中取
+        if CREDENTIAL_POOL_ENABLED:
+            credential = credential_pool.take()
+            room_info = {
+                "room_id" : credential.room_id,
+                "uid" : credential.uid,
+                "app_id" : RTC_APP_ID,
+                "token" : credential.token
+            }
+            RtcLog.debug("room_info", room_info=room_info)
+            return (room_info, credential.expire_at)
+
         uuid_str = uuid.uuid4().hex
         room_id = "G711A" + uuid_str # 根据房间id G711A开头，音频编码格式为g711a
         user_id = "user" + uuid_str
-        expire_time = int(time.time()) + 3600 * 48 # 48h
-        token = AccessToken.AccessToken(RTC_APP_ID, RTC_APP_KEY, room_id, user_id)
-        token.add_privilege(AccessToken.PrivSubscribeStream, expire_time)
-        token.add_privilege(AccessToken.PrivPublishStream, expire_time)
-        token.expire_time(expire_time)
-
-        token_str = token.serialize()
+        expire_time = int(time.time()) + TOKEN_EXPIRE_SECONDS # 48h
+        token_str = AccessToken.mint_tokens(RTC_APP_ID, RTC_APP_KEY, [(room_id, user_id)], expire_time,
+                                            (AccessToken.PrivSubscribeStream, AccessToken.PrivPublishStream))[0]
         room_info = {
             "room_id" : room_id,
             "uid" : user_id,
             "app_id" : RTC_APP_ID,
             "token" : token_str
         }
-        print(room_info)
-        return room_info
+        RtcLog.debug("room_info", room_info=room_info)
+        return (room_info, expire_time)
     
-    def request_start_voice_chat(self, room_info, json_obj):
+    # 智能体配置 (bot_id, voice_id)，请求中没有时使用默认值
+    def get_start_profile(self, json_obj):
         
         if "bot_id" in json_obj:
             bot_id = json_obj["bot_id"]
@@ -131,64 +389,16 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
             voice_id = json_obj["voice_id"]
         else:
             voice_id = DEFAULT_VOICE_ID
-        
-        # 参考 https://www.volcengine.com/docs/6348/1316243
-        request_body = {
-            "AppId" : room_info["app_id"],                               # RTC App id
-            "RoomId" : room_info["room_id"],                             # RTC房间id
-            "UserId" : room_info["uid"],                                 # RTC客户端用户id
-            "config" : {
-                #  "BotName" : "",                                       # 非必填，RTC智能体用户id 
-                "IntterruptMode" : 0,                                    # 非必填，智能体对话打断模式。 0: 智能体语音可以被用户语音打断 1: 不能被用户语音打断
-                "ASRConfig" : {
-                    "AppId" : ASR_APP_ID,                                # ASR App ID
-                    "Cluster" : "volcengine_streaming_common",           # ASR Cluster ID, 默认是通用的 cluster id "volcengine_streaming_common"
-                },
-                "TTSConfig" : {
-                    "IgnoreBracketText" : [1, 2, 3, 4, 5],               # 非必填， 过滤大模型生成的文本中符号 1:"（）" 2:"()", 3:"【】", 4:"[]", 5:"{}".默认不过滤
-                    "Provider" : "volcano",                              # TTS 服务供应商
-                    "ProviderParams" : {
-                        "app" : {
-                            "appid" : TTS_APP_ID,                        # TTS App ID
-                            "cluster" : "volcano_tts"                    # 非必填， TTS Cluster ID. default "volcano_tts"
-                        },
-                        "audio" : {
-                            "voice_type" : voice_id,                     # 非必填，音色类型
-                            "speed_ratio" : 1.0,                         # 非必填，语速，默认 1.0
-                            "volume_ratio" : 1.0,                        # 非必填，音量，默认 1.0
-                            "pitch_ratio" : 1.0,                         # 非必填，音调，默认 1.0
-                        }
-                    }
-                },
-                "LLMConfig" : {
-                    "Mode": "ArkV3",                                     # 模型类型
-                    "EndPointId": bot_id,                                # 推理接入点。使用方舟大模型时必填。
-                    "MaxTokens": 1024,                                   # 非必填，输出文本的最大token数，默认 1024
-                    "Temperature": 0.1,                                  # 非必填，用于控制生成文本的随机性和创造性，值越大随机性越高。取值范围为（0,1]，默认值为 0.1
-                    "TopP": 0.3,                                         # 非必填，用于控制输出tokens的多样性，值越大输出的tokens类型越丰富。取值范围为（0,1]，默认值为 0.3
-                    "SystemMessages": [                                  # 非必填，大模型 System 角色预设指令，可用于控制模型输出。
-                        "你是小宁，性格幽默又善解人意。你在表达时需简明扼要，有自己的观点。"
-                    ],
-                    "UserMessages": [                                    # 非必填，大模型 User 角色预设 Prompt，可用于增强模型的回复质量，模型回复时会参考此处内容。
-                        "user:\"你是谁\"",
-                        "assistant:\"我是问答助手\"",
-                        "user:\"你能干什么\"",
-                        "user:\"我能回答问题\""
-                    ],
-                    "HistoryLength": 3,                                  # 非必填，大模型上下文长度，默认 3。
-                    "WelcomeSpeech": "你好有什么可以帮到你的吗",            # 非必填，智能体启动后的欢迎词。
-                },
-                "SubtitleConfig" : {
-                    "DisableRTSSubtitle" : True,                        # 非必填，是否关闭房间内字幕回调，默认 false
-                },
-            },
-        }
+        return (bot_id, voice_id)
 
-        request_body_str = json.dumps(request_body)
-        canonical_query_string = "Action=%s&Version=%s" % (RTC_API_START_VOICE_CHAT_ACTION, RTC_API_VERSION)
-        code, response = RtcApiRequester.request_rtc_api(RTC_API_HOST, "POST", "/", canonical_query_string, None, request_body_str, AK, SK)
-        print("request_rtc_api start code:", code)
-        print("request_rtc_api start response:", response)
+    def request_start_voice_chat(self, room_info, json_obj):
+        bot_id, voice_id = self.get_start_profile(json_obj)
+
+        # 参考 https://www.volcengine.com/docs/6348/1316243 ，config 部分按 (bot_id, voice_id) 预先序列化
+        with RtcMetrics.span("render_request_body"):
+            request_body_str = start_voice_chat_templates.render(room_info["app_id"], room_info["room_id"], room_info["uid"], bot_id, voice_id)
+        code, response = call_rtc_api(RTC_API_START_VOICE_CHAT_ACTION, request_body_str, retry=start_retry)
+        log_rtc_api_response(RTC_API_START_VOICE_CHAT_ACTION, code, response)
         if code == RESPONSE_CODE_SUCCESS:
             if "Result" in response and response["Result"] == "ok":
                 return None
@@ -206,52 +416,71 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         if "room_id" not in json_obj or "uid" not in json_obj or "app_id" not in json_obj:
             self.response_data(RESPONSE_CODE_REQUEST_ERROR, "stop_voice_chat: \"room_id\", \"uid\", \"app_id\" must be in json")
             return
+        if not self.is_session_fields_str(json_obj):
+            self.response_data(RESPONSE_CODE_REQUEST_ERROR, "stop_voice_chat: \"room_id\", \"uid\", \"app_id\" must be strings")
+            return
+
+        if not self.validate_session(json_obj):
+            return
         
+        resp_obj = {
+            "data" : json_obj
+        }
+        # 设备挂断后不关心上游结果，入队后直接回复 202，队列满时同步调用
+        payload = {
+            "app_id" : json_obj["app_id"],
+            "room_id" : json_obj["room_id"],
+            "uid" : json_obj["uid"]
+        }
+        if STOP_ASYNC_ENABLED and stop_queue.submit(json_obj["room_id"], payload):
+            self.end_session(json_obj["room_id"])
+            self.response_data(RESPONSE_CODE_ACCEPTED, "", resp_obj)
+            return
+
         ret = self.request_stop_voice_chat(json_obj)
         if ret == None:
-            resp_obj = {
-                "data" : json_obj
-            }
+            self.end_session(json_obj["room_id"])
             self.response_data(RESPONSE_CODE_SUCCESS, "", resp_obj)
         else:
             self.response_data(RESPONSE_CODE_SERVER_ERROR, ret)
     
     def request_stop_voice_chat(self, json_obj):
-        # 参考 https://www.volcengine.com/docs/6348/1316244
-        request_body = {
-            "AppId" : json_obj["app_id"],      # rtc app id
-            "RoomId" : json_obj["room_id"],    # rtc 房间 id
-            "UserId" : json_obj["uid"]         # rtc 客户端用户id
-        }
+        return request_stop_voice_chat(json_obj)
 
-        request_body_str = json.dumps(request_body)
-        canonical_query_string = "Action=%s&Version=%s" % (RTC_API_STOP_VOICE_CHAT_ACTION, RTC_API_VERSION)
-        code, response = RtcApiRequester.request_rtc_api(RTC_API_HOST, "POST", "/", canonical_query_string, None, request_body_str, AK, SK)
-        print("request_rtc_api stop code:", code)
-        print("request_rtc_api stop response:", response)
-        if code == RESPONSE_CODE_SUCCESS:
-            if "Result" in response and response["Result"] == "ok":
-                return None
-            else:
-                return response["ResponseMetadata"]["Error"]["Message"]
-        else:
-            if response != None:
-                return response["ResponseMetadata"]["Error"]["Message"]
-            else:
-                return "request rtc api response code " + str(code)
-        return None
+    # 会话已结束，同一设备再次 start 时创建新会话
+    def end_session(self, room_id):
+        if SESSION_REGISTRY_ENABLED:
+            session = session_registry.remove(room_id)
+            if session != None and session.device_id != None:
+                start_coalescer.forget(device_idempotency_key(session.device_id, session.profile))
 
 ###################################### update voice chat #####################################
     def update_voice_chat(self, json_obj):
         if "room_id" not in json_obj or "uid" not in json_obj or "app_id" not in json_obj or "command" not in json_obj:
             self.response_data(RESPONSE_CODE_REQUEST_ERROR, "update_voice_chat: \"room_id\", \"uid\", \"app_id\", \"command\" must be in json")
             return
+        if not self.is_session_fields_str(json_obj):
+            self.response_data(RESPONSE_CODE_REQUEST_ERROR, "update_voice_chat: \"room_id\", \"uid\", \"app_id\" must be strings")
+            return
         
         if json_obj["command"] == "function" and "message" not in json_obj:
             self.response_data(RESPONSE_CODE_REQUEST_ERROR, "update_voice_chat: your command == function, \"message\" must be in json")
             return
+
+        message_obj = None
+        if json_obj["command"] == "function":
+            message_obj = self.parse_function_message(json_obj["message"])
+            if message_obj == None:
+                self.response_data(RESPONSE_CODE_REQUEST_ERROR, "update_voice_chat: \"message\" must be a json object string, \"tool_calls\" must be a list")
+                return
+
+        if not self.validate_session(json_obj):
+            return
         
-        ret = self.request_update_voice_chat(json_obj)
+        if message_obj != None:
+            ret = self.request_function_results(json_obj, message_obj)
+        else:
+            ret = self.request_update_voice_chat(json_obj)
         if ret == None:
             resp_obj = {
                 "data" : json_obj
@@ -259,8 +488,21 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
             self.response_data(RESPONSE_CODE_SUCCESS, "", resp_obj)
         else:
             self.response_data(RESPONSE_CODE_SERVER_ERROR, ret)
+
+        if json_obj["command"] == "interrupt":
+            elapsed = time.perf_counter() - self.request_started
+            interrupt_seconds.observe(elapsed)
+            if elapsed > INTERRUPT_SLO_SECONDS:
+                interrupt_slo_violations_total.inc()
     
-    def request_update_voice_chat(self, json_obj):
+    # message 为工具调用结果的 json 字符串，command 为 function 时必填
+    def request_update_voice_chat(self, json_obj, message=None):
+        # 打断走快速路径: 请求体直接拼接，最高优先级获取上游名额，短截止时间
+        if json_obj["command"] == "interrupt":
+            request_body_str = RtcVoiceChatTemplate.render_interrupt(json_obj["app_id"], json_obj["room_id"], json_obj["uid"])
+            code, response = call_rtc_api(RTC_API_UPDATE_VOICE_CHAT_ACTION, request_body_str, RtcPriorityGate.PRIORITY_INTERRUPT, interrupt_retry)
+            return self.get_update_voice_chat_error(code, response)
+
         # 参考 https://www.volcengine.com/docs/6348/1316245
         request_body = {
             "AppId" : json_obj["app_id"],      # rtc app id
@@ -269,40 +511,59 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
             "Command" : json_obj["command"]    # 更新指令 interrupt： 打断智能体说话；function：传回工具调用信息指令。
             # "Message" : "..."                # 工具调用信息指令，格式为 Json 转译字符串。Command 取值为 function时，Message必填。
         }
-        if json_obj["command"] == "function":
-            # function calling 数据， 参考 https://www.volcengine.com/docs/6348/1359441
-            # {
-            #     "subscriber_user_id" : "",
-            #     "tool_calls" : 
-            #     [
-            #         {
-            #             "function" : 
-            #             {
-            #                 "arguments" : "{\\"location\\": \\"\\u5317\\u4eac\\u5e02\\"}",
-            #                 "name" : "get_current_weather"
-            #             },
-            #             "id" : "call_py400kek0e3pczrqdxgnb3lo",
-            #             "type" : "function"
-            #         }
-            #     ]
-            # }
-            try:
-                json_obj = json.loads(json_obj["message"])
-            except Exception as e:
-                self.response_data(RESPONSE_CODE_REQUEST_ERROR, "post data is not json string.")
-                return
-            # 下面代码只是示例，要根据实际情况，解析函数名称和参数，做出真实的响应
-            message_body = {
-                "ToolCallID" : json_obj["tool_calls"][0]["id"],
-                "Content" : "今天天气很好，阳光明媚，偶尔有微风。"
-            }
-            request_body["Message"] = json.dumps(message_body)
+        if message != None:
+            request_body["Message"] = message
         
         request_body_str = json.dumps(request_body)
-        canonical_query_string = "Action=%s&Version=%s" % (RTC_API_UPDATE_VOICE_CHAT_ACTION, RTC_API_VERSION)
-        code, response = RtcApiRequester.request_rtc_api(RTC_API_HOST, "POST", "/", canonical_query_string, None, request_body_str, AK, SK)
-        print("request_rtc_api update code:", code)
-        print("request_rtc_api update response:", response)
+        code, response = call_rtc_api(RTC_API_UPDATE_VOICE_CHAT_ACTION, request_body_str, RtcPriorityGate.PRIORITY_UPDATE)
+        return self.get_update_voice_chat_error(code, response)
+
+    # function calling 数据， 参考 https://www.volcengine.com/docs/6348/1359441
+    # {
+    #     "subscriber_user_id" : "",
+    #     "tool_calls" : 
+    #     [
+    #         {
+    #             "function" : 
+    #             {
+    #                 "arguments" : "{\\"location\\": \\"\\u5317\\u4eac\\u5e02\\"}",
+    #                 "name" : "get_current_weather"
+    #             },
+    #             "id" : "call_py400kek0e3pczrqdxgnb3lo",
+    #             "type" : "function"
+    #         }
+    #     ]
+    # }
+    # 设备也可以直接传回工具结果 {"ToolCallID" : "...", "Content" : "..."}，原样转发
+    def parse_function_message(self, message):
+        try:
+            message_obj = json.loads(message)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(message_obj, dict):
+            return None
+        if "tool_calls" in message_obj and not isinstance(message_obj["tool_calls"], list):
+            return None
+        return message_obj
+
+    # 所有工具同时执行，每个工具完成后立即用 UpdateVoiceChat 传回结果，返回第一个错误信息
+    def request_function_results(self, json_obj, message_obj):
+        if "tool_calls" not in message_obj:
+            return self.request_update_voice_chat(json_obj, json_obj["message"])
+        err = None
+        for tool_call_id, content in tool_dispatcher.run(message_obj["tool_calls"]):
+            message_body = {
+                "ToolCallID" : tool_call_id,
+                "Content" : content
+            }
+            ret = self.request_update_voice_chat(json_obj, json.dumps(message_body))
+            if ret != None and err == None:
+                err = ret
+        return err
+
+    # 上游成功返回 None，否则返回错误信息
+    def get_update_voice_chat_error(self, code, response):
+        log_rtc_api_response(RTC_API_UPDATE_VOICE_CHAT_ACTION, code, response)
         if code == RESPONSE_CODE_SUCCESS:
             if "Result" in response and response["Result"] == "ok":
                 return None
@@ -317,9 +578,39 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
 
 
 ##############################################################################################
-    def response_data(self, code, msg, extra_data = None):
+    # 设备标识，优先取 header X-Device-Id，其次取 json 中的 device_id，都没有返回 None
+    def get_device_id(self, json_obj):
+        device_id = self.headers.get("X-Device-Id")
+        if device_id == None or device_id == "":
+            device_id = json_obj.get("device_id")
+        if device_id == None or device_id == "":
+            return None
+        return str(device_id)
+
+    # room_id、uid、app_id 要作为注册表和 stop 队列的 key，必须是字符串
+    def is_session_fields_str(self, json_obj):
+        return isinstance(json_obj["room_id"], str) and isinstance(json_obj["uid"], str) and isinstance(json_obj["app_id"], str)
+
+    # 本地校验 stop / update 请求对应的会话，校验失败时已经回复客户端，返回 False
+    def validate_session(self, json_obj):
+        if not SESSION_REGISTRY_ENABLED:
+            return True
+        if not SESSION_VALIDATE_REQUESTS:
+            session_registry.touch(json_obj["room_id"])
+            return True
+        err = session_registry.validate(json_obj["app_id"], json_obj["room_id"], json_obj["uid"])
+        if err != None:
+            self.response_data(RESPONSE_CODE_NOT_FOUND, err)
+            return False
+        session_registry.touch(json_obj["room_id"])
+        return True
+
+    def response_data(self, code, msg, extra_data = None, headers = None):
         self.send_response(code)
         self.send_header('Content-type', 'application/json')
+        if headers != None:
+            for k, v in headers.items():
+                self.send_header(k, v)
         self.end_headers()
         ret_data = {
             "code": code,
@@ -336,8 +627,9 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         # check headers
         content_type = self.headers.get("Content-Type")
         authorization = self.headers.get("Authorization")
-        if content_type != "application/json":
-            self.response_data(RESPONSE_CODE_REQUEST_ERROR, "header Content-Type error, must be application/json.")
+        # 允许带 charset 等参数，如 application/json; charset=utf-8
+        if content_type == None or content_type.split(";", 1)[0].strip().lower() != "application/json":
+            self.response_data(RESPONSE_CODE_UNSUPPORTED_MEDIA_TYPE, "header Content-Type error, must be application/json.")
             return None
         if authorization == None or authorization == "":
             self.response_data(RESPONSE_CODE_REQUEST_ERROR, "header Authorization error, Authorization not be set.")
@@ -345,21 +637,97 @@ class RtcAigcHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         if authorization != ("af78e30" +  RTC_APP_ID):
             self.response_data(RESPONSE_CODE_REQUEST_ERROR, "header Authorization error, Bad Authorization.")
             return None
+        # Authorization 与 app_id 一一对应，按 app_id 限流不需要读取请求体
+        if not self.check_rate_limit(app_rate_limiter, "app", RTC_APP_ID):
+            self.close_connection = True
+            return None
         
-        # check post_data is json
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length).decode('utf-8')
+        # check Content-Length，在读取请求体之前拒绝没有长度(chunked)或超过 MAX_POST_BODY_SIZE 的请求，
+        # 未读取的请求体留在连接中，回复后关闭连接
+        content_length = self.headers.get("Content-Length")
+        if content_length == None:
+            self.close_connection = True
+            self.response_data(RESPONSE_CODE_LENGTH_REQUIRED, "header Content-Length error, Content-Length must be set.")
+            return None
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self.close_connection = True
+            self.response_data(RESPONSE_CODE_REQUEST_ERROR, "header Content-Length error, Bad Content-Length.")
+            return None
+        if content_length > MAX_POST_BODY_SIZE:
+            self.close_connection = True
+            self.response_data(RESPONSE_CODE_PAYLOAD_TOO_LARGE, "post data too large, must not exceed %d bytes." % MAX_POST_BODY_SIZE)
+            return None
+
+        # check post_data is json，json.loads 直接解析 bytes，不再先 decode 成 str
+        try:
+            post_data = self.rfile.read(content_length)
+        except TimeoutError:
+            self.close_connection = True
+            self.response_data(RESPONSE_CODE_REQUEST_TIMEOUT, "post data not received within %s seconds." % REQUEST_TIMEOUT)
+            return None
+        if len(post_data) != content_length:
+            self.close_connection = True
+            self.response_data(RESPONSE_CODE_REQUEST_ERROR, "post data is shorter than Content-Length.")
+            return None
         json_obj = None
         try:
             json_obj = json.loads(post_data)
-        except Exception as e:
+        except ValueError:
             self.response_data(RESPONSE_CODE_REQUEST_ERROR, "post data is not json string.")
             return None
+        if not isinstance(json_obj, dict):
+            self.response_data(RESPONSE_CODE_REQUEST_ERROR, "post data must be a json object.")
+            return None
+        # 没有设备标识时不按设备限流，NAT 后面的设备共享一个 IP，只由 app_id 限流兜底
+        device_id = self.get_device_id(json_obj)
+        if device_id != None and not self.check_rate_limit(device_rate_limiter, "device", device_id):
+            return None
         return json_obj
 
+    # 令牌桶限流，超过时回复 429 并返回 False
+    def check_rate_limit(self, limiter, scope, key):
+        if not RATE_LIMIT_ENABLED:
+            return True
+        retry_after = limiter.acquire(key)
+        if retry_after == 0:
+            return True
+        rate_limited_total.inc((scope,))
+        self.response_data(RESPONSE_CODE_TOO_MANY_REQUESTS, "too many requests, limited by " + scope + ".", None,
+                           {"Retry-After" : RtcRateLimiter.retry_after_header(retry_after)})
+        return False
+
+
+
+# 运行服务，多进程模式下 worker 为 RtcAigcSupervisor.Worker，在工作进程中调用
+def serve(worker=None):
+    if CREDENTIAL_POOL_ENABLED:
+        credential_pool.start()
+    if SESSION_REGISTRY_ENABLED and SESSION_REAPER_ENABLED:
+        session_reaper.start()
+    try:
+        with RtcAigcServer.create_server(("", PORT), RtcAigcHTTPRequestHandler, SERVER_MODE, SERVER_POOL_WORKERS, SERVER_MAX_IN_FLIGHT,
+                                         worker != None) as httpd:
+            if worker != None:
+                httpd.heartbeat = worker.beat
+            RtcLog.info("serving", port=PORT, mode=SERVER_MODE, worker=worker.index if worker != None else None)
+            httpd.serve_forever()
+    finally:
+        # 退出前尽量把已经入队的 stop 发出去
+        stop_queue.stop(5)
 
 
 # 启动服务
-with socketserver.TCPServer(("", PORT), RtcAigcHTTPRequestHandler) as httpd:
-    print("serving at port", PORT)
-    httpd.serve_forever()
+if __name__ == "__main__":
+    processes = SERVER_PROCESSES if SERVER_PROCESSES > 0 else os.cpu_count()
+    if processes > 1:
+        # 会话只记录在处理 start 的进程中，其它进程会把该会话的 stop / update 校验为 404，也看不到它的活跃时间
+        if SESSION_REGISTRY_ENABLED:
+            RtcLog.warning("session_registry_disabled", processes=processes, reason="session registry is per process")
+            SESSION_REGISTRY_ENABLED = False
+        RtcAigcSupervisor.Supervisor(serve, processes, SERVER_HEALTH_TIMEOUT).run()
+    else:
+        serve()
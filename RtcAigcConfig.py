@@ -31,6 +31,122 @@ DEFAULT_VOICE_ID = ""
 ASR_APP_ID = ""
 TTS_APP_ID = ""
 
+# 服务端口
+PORT = 8080
+# 服务并发模式: "single" 单线程, "thread" 每请求一个线程, "pool" 固定线程池, "asyncio" asyncio事件循环 + 线程池
+SERVER_MODE = "thread"
+# "pool" 和 "asyncio" 模式下的工作线程数
+SERVER_POOL_WORKERS = 32
+# 同时处理中的最大请求数，超过后新连接在 listen 队列中排队，<= 0 表示不限制
+SERVER_MAX_IN_FLIGHT = 128
+# 工作进程数，大于 1 时主进程 fork 出多个工作进程，用 SO_REUSEPORT 共享端口，0 表示 CPU 核数。
+# 限流、start 合并、stop 队列等内存状态每个进程各自一份，限流的实际上限约为配置值 × 进程数。
+# 同一设备的后续请求会被内核分到任意进程，会话注册表在多进程模式下自动关闭(不做本地校验、不按设备返回已有会话、不回收空闲会话)
+SERVER_PROCESSES = 1
+# 多进程模式下工作进程心跳超过这个时间(秒)没有更新时重启该进程
+SERVER_HEALTH_TIMEOUT = 10.0
+# 请求体最大字节数，Content-Length 超过时直接返回 413，不读取请求体
+MAX_POST_BODY_SIZE = 64 * 1024
+# 客户端请求的读取截止时间(秒)，从等待请求行开始，请求行、请求头和请求体(包括 keep-alive 空闲)总共超过这个时间就断开，
+# 避免慢客户端长期占用处理名额
+REQUEST_TIMEOUT = 10
+# 令牌桶限流，超过时返回 429 和 Retry-After: 每个设备(X-Device-Id / device_id，都没有时不按设备限流)每秒 DEVICE_RATE 个请求，
+# 最多突发 DEVICE_BURST 个；每个 app_id 每秒 APP_RATE 个，最多突发 APP_BURST 个；最多记录 MAX_KEYS 个设备
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_DEVICE_RATE = 1.0
+RATE_LIMIT_DEVICE_BURST = 10
+RATE_LIMIT_APP_RATE = 200.0
+RATE_LIMIT_APP_BURST = 400
+RATE_LIMIT_MAX_KEYS = 100000
+
+# token 有效期，单位秒
+TOKEN_EXPIRE_SECONDS = 3600 * 48
+# 预生成房间凭证(room_id、uid、token)，池中少于 LOW_WATERMARK 个时后台补充到 HIGH_WATERMARK 个，
+# 生成超过 MAX_AGE 秒的凭证丢弃，发给设备的 token 剩余有效期不少于 TOKEN_EXPIRE_SECONDS - MAX_AGE
+CREDENTIAL_POOL_ENABLED = True
+CREDENTIAL_POOL_LOW_WATERMARK = 32
+CREDENTIAL_POOL_HIGH_WATERMARK = 128
+CREDENTIAL_POOL_MAX_AGE = 600
+# 是否在内存中记录通过本服务启动的会话，同一设备(header X-Device-Id 或 json device_id)重复 start 时直接返回已有会话
+SESSION_REGISTRY_ENABLED = True
+# 是否用会话记录在本地校验 stop / update 请求的 app_id、uid 与 room_id 是否匹配，不匹配时返回 404；
+# 没有记录的会话(服务重启前或其它实例启动的)不校验，照常转发给上游
+SESSION_VALIDATE_REQUESTS = True
+# 回收空闲会话: 会话超过 SESSION_IDLE_TIMEOUT 秒没有 start / update 请求时停止智能体，每 SESSION_REAPER_INTERVAL 秒检查一次。
+# 活跃时间只能看到设备发给本服务的请求，超时时间要大于一次对话的最长时间
+SESSION_REAPER_ENABLED = True
+SESSION_IDLE_TIMEOUT = 3600
+SESSION_REAPER_INTERVAL = 30
+# start 请求幂等：相同 header Idempotency-Key 或相同设备标识的并发 start 只调用一次上游，结果共享。
+# 按设备标识合并需要会话注册表在 stop 时清除合并结果，注册表关闭时只按 Idempotency-Key 合并
+START_IDEMPOTENCY_ENABLED = True
+# 成功的 start 结果在该时间内(秒)对重复请求直接重放
+START_IDEMPOTENCY_WINDOW = 60
+# StartVoiceChat 请求体模板最多缓存的 (bot_id, voice_id) 组合数
+START_TEMPLATE_MAX_PROFILES = 64
+# 是否记录每个请求各阶段耗时，并通过 GET /metrics 以 Prometheus 文本格式输出
+METRICS_ENABLED = True
+# 日志级别，日志由后台线程以 json 行写到 stdout，token 等敏感字段会被替换
+LOG_LEVEL = "INFO"
+# 日志队列长度，队列满时丢弃新日志，不阻塞请求
+LOG_QUEUE_SIZE = 10000
+# 高频事件的采样率，0 ~ 1，未配置的事件全部输出；warning 及以上级别不采样
+LOG_SAMPLE_RATES = {
+    "access" : 0.1,
+    "rtc_api_response" : 0.1,
+}
+
+# RTC OpenAPI 地址和协议，使用本地替身服务 RtcApiMockServer 压测时改成 "127.0.0.1:9090" 和 "http"
+RTC_API_HOST = "rtc.volcengineapi.com"
+RTC_API_SCHEME = "https"
+# 每个 host 保留的 keep-alive 空闲连接数
+RTC_HTTP_POOL_SIZE = 32
+# 建立连接超时和读超时，单位秒
+RTC_HTTP_CONNECT_TIMEOUT = 3.0
+RTC_HTTP_READ_TIMEOUT = 10.0
+
+# RTC OpenAPI 临时错误(5xx、429、连接异常)重试: 最多请求次数，退避基准和上限(秒)，单个请求包含重试的总截止时间(秒)。
+# StartVoiceChat 不是幂等的，只在连接没有建立或 429 时重试
+RTC_API_RETRY_MAX_ATTEMPTS = 3
+RTC_API_RETRY_BASE_DELAY = 0.05
+RTC_API_RETRY_MAX_DELAY = 1.0
+RTC_API_RETRY_DEADLINE = 5.0
+# 重试预算: 每个请求增加 RATIO 次重试额度，每秒另外补充 MIN_PER_SECOND 次，最多累积 CAPACITY 次
+RTC_API_RETRY_BUDGET_RATIO = 0.1
+RTC_API_RETRY_BUDGET_MIN_PER_SECOND = 10
+RTC_API_RETRY_BUDGET_CAPACITY = 100
+
+# RTC OpenAPI 熔断: 每个 action 最近 WINDOW 秒内请求数达到 MIN_REQUESTS 且失败率达到 FAILURE_RATIO 时熔断，
+# 熔断 OPEN_DURATION 秒后放行 HALF_OPEN_PROBES 个探测请求，全部成功则恢复
+RTC_API_CIRCUIT_BREAKER_ENABLED = True
+RTC_API_CIRCUIT_FAILURE_RATIO = 0.5
+RTC_API_CIRCUIT_MIN_REQUESTS = 20
+RTC_API_CIRCUIT_WINDOW = 10
+RTC_API_CIRCUIT_OPEN_DURATION = 5.0
+RTC_API_CIRCUIT_HALF_OPEN_PROBES = 3
+
+# 同时在途的 RTC OpenAPI 请求上限，满了以后按优先级排队: interrupt > function > start / stop，0 表示不限制
+RTC_API_MAX_CONCURRENT = 64
+# 打断请求: 包含排队和重试的总截止时间(秒)，超过就没有意义了；服务端处理耗时的 SLO(秒)，超过计入 rtc_aigc_interrupt_slo_violations_total
+INTERRUPT_DEADLINE = 0.3
+INTERRUPT_SLO_SECONDS = 0.05
+
+# function calling 工具执行: 线程池大小，默认单个工具超时时间(秒)，超时的工具回复超时说明
+TOOL_WORKERS = 16
+TOOL_TIMEOUT = 3.0
+# 工具结果缓存最多保存的条数，每个工具的缓存时间在注册工具时用 cache_ttl 指定，0 表示不缓存
+TOOL_CACHE_MAX_ENTRIES = 1024
+
+# 后台 stop 队列: STOP_ASYNC_ENABLED = True 时 /stopvoicechat 入队后立即回复 202(默认同步调用并回复 200)，
+# 回收空闲会话总是使用队列。工作线程数，每秒最多调用次数，失败重试次数和首次重试间隔(秒，之后翻倍)，
+# 队列长度上限(满了以后同步调用)
+STOP_ASYNC_ENABLED = False
+STOP_QUEUE_WORKERS = 2
+STOP_QUEUE_RATE = 20.0
+STOP_QUEUE_MAX_ATTEMPTS = 5
+STOP_QUEUE_RETRY_DELAY = 2.0
+STOP_QUEUE_MAX_PENDING = 10000
+
 # 音频配置参数
 CHUNK = 1024      # 数据块大小
 RATE = 16000      # 采样率
@@ -0,0 +1,236 @@
+# RtcAigcHTTPRequestHandler 的服务端并发模式
+# single  : 单线程 socketserver.TCPServer，请求依次处理
+# thread  : 每个请求一个线程
+# pool    : 固定大小的工作线程池
+# asyncio : asyncio 事件循环负责 accept，请求交给线程池执行
+# 所有模式都可以用 max_in_flight 限制同时处理中的请求数，超过后不再 accept，新连接在 listen 队列中等待。
+# reuse_port 为 True 时监听 socket 设置 SO_REUSEPORT，多个进程可以绑定同一端口(见 RtcAigcSupervisor)；
+# heartbeat 不为 None 时在 accept 循环中定期调用(包括等待 max_in_flight 名额期间)，用于多进程模式的健康检查
+import asyncio
+import io
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_MODE_SINGLE = "single"
+SERVER_MODE_THREAD = "thread"
+SERVER_MODE_POOL = "pool"
+SERVER_MODE_ASYNCIO = "asyncio"
+
+SERVER_MODES = (SERVER_MODE_SINGLE, SERVER_MODE_THREAD, SERVER_MODE_POOL, SERVER_MODE_ASYNCIO)
+
+
+class InFlightLimitMixIn:
+    # max_in_flight <= 0 表示不限制
+    def init_in_flight_limit(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        if max_in_flight > 0:
+            self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        else:
+            self._in_flight = None
+
+    # 名额用完时 accept 循环阻塞在这里，每 0.5 秒醒来调用一次 service_actions，忙碌的进程不会因为心跳中断被重启
+    def acquire_in_flight(self):
+        if self._in_flight is not None:
+            while not self._in_flight.acquire(timeout=0.5):
+                self.service_actions()
+
+    def release_in_flight(self):
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+
+# handler 的 rfile 底层读取，每次 recv 前把 socket 超时缩短为距 deadline 的剩余时间，
+# 一点一点发送数据的慢客户端也不能让整个请求的读取时间超过 deadline
+class DeadlineSocketReader(io.RawIOBase):
+
+    def __init__(self, sock):
+        self._sock = sock
+        # time.monotonic() 时间，None 表示只用 socket 本身的超时
+        self.deadline = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("request deadline exceeded")
+            self._sock.settimeout(remaining)
+        return self._sock.recv_into(b)
+
+
+class ReusePortMixIn:
+    reuse_port = False
+    heartbeat = None
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        socketserver.TCPServer.server_bind(self)
+
+    def service_actions(self):
+        if self.heartbeat is not None:
+            self.heartbeat()
+
+
+class SingleRtcServer(ReusePortMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=0, max_in_flight=0, reuse_port=False):
+        self.reuse_port = reuse_port
+        socketserver.TCPServer.__init__(self, server_address, handler_class)
+
+
+class ThreadedRtcServer(InFlightLimitMixIn, ReusePortMixIn, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, server_address, handler_class, workers=0, max_in_flight=0, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.init_in_flight_limit(max_in_flight)
+        socketserver.TCPServer.__init__(self, server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.acquire_in_flight()
+        try:
+            socketserver.ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self.release_in_flight()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self.release_in_flight()
+
+
+class PooledRtcServer(InFlightLimitMixIn, ReusePortMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=32, max_in_flight=0, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.init_in_flight_limit(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rtc-worker")
+        socketserver.TCPServer.__init__(self, server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.acquire_in_flight()
+        try:
+            self.executor.submit(self.process_request_worker, request, client_address)
+        except Exception:
+            self.release_in_flight()
+            self.shutdown_request(request)
+            raise
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.release_in_flight()
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        self.executor.shutdown(wait=False)
+
+
+class AsyncioRtcServer(ReusePortMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=32, max_in_flight=0, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rtc-worker")
+        self._loop = None
+        self._serve_task = None
+        self._stopped = threading.Event()
+        socketserver.TCPServer.__init__(self, server_address, handler_class)
+
+    def serve_forever(self, poll_interval=0.5):
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        loop = self._loop
+        if loop is not None and self._serve_task is not None:
+            loop.call_soon_threadsafe(self._serve_task.cancel)
+            self._stopped.wait()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._serve_task = asyncio.current_task()
+        self.socket.setblocking(False)
+        limit = asyncio.Semaphore(self.max_in_flight) if self.max_in_flight > 0 else None
+        service_task = asyncio.ensure_future(self._service_loop())
+        try:
+            while True:
+                if limit is not None:
+                    await limit.acquire()
+                try:
+                    request, client_address = await self._loop.sock_accept(self.socket)
+                except asyncio.CancelledError:
+                    raise
+                except OSError:
+                    if limit is not None:
+                        limit.release()
+                    continue
+                # handler 使用阻塞读写
+                request.setblocking(True)
+                future = self._loop.run_in_executor(self.executor, self.process_request_worker, request, client_address)
+                if limit is not None:
+                    future.add_done_callback(lambda _: limit.release())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            service_task.cancel()
+            self._loop = None
+            self._serve_task = None
+
+    # 与 socketserver.serve_forever 一样每 0.5 秒调用一次 service_actions
+    async def _service_loop(self):
+        while True:
+            self.service_actions()
+            await asyncio.sleep(0.5)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        self.executor.shutdown(wait=False)
+
+
+SERVER_CLASSES = {
+    SERVER_MODE_SINGLE : SingleRtcServer,
+    SERVER_MODE_THREAD : ThreadedRtcServer,
+    SERVER_MODE_POOL : PooledRtcServer,
+    SERVER_MODE_ASYNCIO : AsyncioRtcServer,
+}
+
+
+def create_server(server_address, handler_class, mode=SERVER_MODE_THREAD, workers=32, max_in_flight=0, reuse_port=False):
+    if mode not in SERVER_CLASSES:
+        raise ValueError("unknown server mode: %s, must be one of %s" % (mode, ", ".join(SERVER_MODES)))
+    if reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        raise ValueError("SO_REUSEPORT is not supported on this platform")
+    return SERVER_CLASSES[mode](server_address, handler_class, workers, max_in_flight, reuse_port)
@@ -0,0 +1,155 @@
+# 多进程模式
+# 主进程只做管理: fork 出 processes 个工作进程，每个工作进程各自创建服务并用 SO_REUSEPORT 绑定同一端口，
+# 由内核在进程间分配新连接，json 处理、token HMAC 和请求签名不再受单个进程的 GIL 限制。
+# 工作进程在 accept 循环中定期把心跳时间写入共享内存，主进程发现工作进程退出，或心跳超过 health_timeout 秒
+# 没有更新(accept 循环卡住)时杀掉并重启该进程；启动后 min_uptime 秒内就退出的进程按指数退避重启，避免反复 fork。
+# 主进程收到 SIGTERM / SIGINT 后向工作进程发送 SIGTERM，等待 grace 秒后强制结束。
+# 注意: start 合并、限流、凭证池、stop 队列等内存状态都是每个工作进程各自一份；
+# 同一设备的请求会落到不同进程，会话注册表无法在进程间共享，多进程模式下由服务入口关闭
+import mmap
+import os
+import signal
+import struct
+import sys
+import time
+
+import RtcLog
+
+_heartbeat_struct = struct.Struct("d")
+
+
+class Worker:
+
+    def __init__(self, index, heartbeats):
+        self.index = index
+        self.pid = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+        self._heartbeats = heartbeats
+
+    # 工作进程调用，记录心跳时间。CLOCK_MONOTONIC 在进程间一致
+    def beat(self):
+        _heartbeat_struct.pack_into(self._heartbeats, self.index * _heartbeat_struct.size, time.monotonic())
+
+    def last_beat(self):
+        return _heartbeat_struct.unpack_from(self._heartbeats, self.index * _heartbeat_struct.size)[0]
+
+
+class Supervisor:
+
+    # target(worker) 在工作进程中运行服务，返回后工作进程退出
+    def __init__(self, target, processes, health_timeout=10.0, check_interval=1.0, min_uptime=5.0, max_restart_delay=30.0, grace=10.0):
+        self.target = target
+        self.processes = processes
+        self.health_timeout = health_timeout
+        self.check_interval = check_interval
+        self.min_uptime = min_uptime
+        self.max_restart_delay = max_restart_delay
+        self.grace = grace
+        self._heartbeats = mmap.mmap(-1, _heartbeat_struct.size * processes)
+        self.workers = [Worker(i, self._heartbeats) for i in range(processes)]
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        RtcLog.info("supervisor_start", processes=self.processes, pid=os.getpid())
+        for worker in self.workers:
+            self._spawn(worker)
+        while not self._stopping:
+            self._reap()
+            self._check_health()
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.pid == None and worker.restart_at <= now and not self._stopping:
+                    self._spawn(worker)
+            time.sleep(self.check_interval)
+        self._terminate()
+        RtcLog.info("supervisor_stop", pid=os.getpid())
+
+    def _on_signal(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self, worker):
+        worker.beat()
+        # 日志后台线程不会被 fork 到子进程，fork 前停掉，父子进程各自重新启动
+        RtcLog.shutdown()
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(worker)
+        RtcLog.setup()
+        worker.pid = pid
+        worker.started_at = time.monotonic()
+        RtcLog.info("worker_start", worker=worker.index, pid=pid)
+
+    def _run_worker(self, worker):
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            RtcLog.setup()
+            self.target(worker)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0
+        except BaseException:
+            RtcLog.exception("worker_error", worker=worker.index)
+            code = 1
+        finally:
+            RtcLog.shutdown()
+            os._exit(code)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for worker in self.workers:
+                if worker.pid == pid:
+                    self._on_exit(worker, status)
+
+    def _on_exit(self, worker, status):
+        worker.pid = None
+        now = time.monotonic()
+        if now - worker.started_at < self.min_uptime:
+            worker.failures += 1
+        else:
+            worker.failures = 0
+        delay = min(self.max_restart_delay, 0.5 * (2 ** worker.failures)) if worker.failures > 0 else 0
+        worker.restart_at = now + delay
+        if not self._stopping:
+            RtcLog.warning("worker_exit", worker=worker.index, status=status, restart_in=delay)
+
+    def _check_health(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.pid != None and now - worker.last_beat() > self.health_timeout:
+                RtcLog.error("worker_unhealthy", worker=worker.index, pid=worker.pid, since_heartbeat=now - worker.last_beat())
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _terminate(self):
+        for worker in self.workers:
+            if worker.pid != None:
+                try:
+                    os.kill(worker.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        deadline = time.monotonic() + self.grace
+        while any(worker.pid != None for worker in self.workers) and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for worker in self.workers:
+            if worker.pid != None:
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        while any(worker.pid != None for worker in self.workers):
+            self._reap()
+            time.sleep(0.05)
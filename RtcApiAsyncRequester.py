@@ -0,0 +1,197 @@
+# RtcApiRequester.request_rtc_api 的 asyncio 版本
+# 签名与同步版本共用 RtcApiRequester.RequestSigner，HTTP 请求基于 asyncio streams，
+# 同一个事件循环上可以并发发起大量 Start/Stop/UpdateVoiceChat 请求，不需要每个请求一个线程:
+#
+#     results = await asyncio.gather(*[
+#         RtcApiAsyncRequester.request_rtc_api(host, "POST", "/", query, None, body, AK, SK) for body in bodies
+#     ])
+import asyncio
+import collections
+import ssl
+import weakref
+
+import RtcApiRequester
+
+from RtcAigcConfig import RTC_API_SCHEME, RTC_HTTP_POOL_SIZE, RTC_HTTP_CONNECT_TIMEOUT, RTC_HTTP_READ_TIMEOUT
+
+# 复用的空闲连接可能已经被服务端关闭，这些异常出现时换新连接重试一次
+STALE_CONNECTION_ERRORS = (
+    ConnectionError,
+    asyncio.IncompleteReadError,
+)
+
+
+class AsyncHttpConnectionPool:
+
+    def __init__(self, host, scheme="https", pool_size=8, connect_timeout=3.0, read_timeout=10.0, ssl_context=None, max_connections=0):
+        if scheme not in ("http", "https"):
+            raise ValueError("unsupported scheme: " + scheme)
+        self.host = host
+        self.scheme = scheme
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        if scheme == "https" and ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        self.ssl_context = ssl_context
+        if ":" in host:
+            self._address = (host.rsplit(":", 1)[0], int(host.rsplit(":", 1)[1]))
+        else:
+            self._address = (host, 443 if scheme == "https" else 80)
+        # max_connections > 0 时限制同时打开的连接数，多出来的请求排队等待
+        self._limit = asyncio.Semaphore(max_connections) if max_connections > 0 else None
+        self._idle = collections.deque()
+        self.stats = {
+            "hits" : 0,
+            "misses" : 0,
+            "discards" : 0,
+            "retries" : 0,
+        }
+
+    async def request(self, method, url, body=None, headers=None):
+        if self._limit is not None:
+            async with self._limit:
+                return await self._request(method, url, body, headers)
+        return await self._request(method, url, body, headers)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+    def idle_count(self):
+        return len(self._idle)
+
+    async def _request(self, method, url, body, headers):
+        conn, reused = await self._get_connection()
+        try:
+            status, data, will_close = await asyncio.wait_for(self._do_request(conn, method, url, body, headers), self.read_timeout)
+        except STALE_CONNECTION_ERRORS:
+            conn[1].close()
+            if not reused:
+                raise
+            self.stats["retries"] += 1
+            conn = await self._new_connection()
+            try:
+                status, data, will_close = await asyncio.wait_for(self._do_request(conn, method, url, body, headers), self.read_timeout)
+            except BaseException:
+                conn[1].close()
+                raise
+        except BaseException:
+            conn[1].close()
+            raise
+
+        if will_close:
+            conn[1].close()
+            self.stats["discards"] += 1
+        else:
+            self._put_connection(conn)
+        return (status, data)
+
+    async def _do_request(self, conn, method, url, body, headers):
+        reader, writer = conn
+        headers = dict(headers or {})
+        if "Host" not in headers:
+            headers["Host"] = self.host
+        headers["Content-Length"] = str(len(body) if body else 0)
+        lines = [method + " " + url + " HTTP/1.1"]
+        for k, v in headers.items():
+            lines.append(k + ": " + v)
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise ConnectionResetError("connection closed while reading headers")
+            k, v = line.decode("latin-1").split(":", 1)
+            response_headers[k.strip().lower()] = v.strip()
+
+        connection = response_headers.get("connection", "").lower()
+        will_close = connection == "close" or (version == "HTTP/1.0" and connection != "keep-alive")
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked(reader)
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            data = await reader.read()
+            will_close = True
+        return (int(status), data, will_close)
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # 跳过 trailer
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def _get_connection(self):
+        while self._idle:
+            conn = self._idle.pop()
+            # 已经收到 EOF 的空闲连接直接丢弃
+            if conn[0].at_eof() or conn[1].is_closing():
+                conn[1].close()
+                self.stats["discards"] += 1
+                continue
+            self.stats["hits"] += 1
+            return (conn, True)
+        return (await self._new_connection(), False)
+
+    async def _new_connection(self):
+        self.stats["misses"] += 1
+        host, port = self._address
+        ssl_context = self.ssl_context if self.scheme == "https" else None
+        server_hostname = host if ssl_context is not None else None
+        return await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=server_hostname), self.connect_timeout)
+
+    def _put_connection(self, conn):
+        if len(self._idle) < self.pool_size:
+            self._idle.append(conn)
+            return
+        self.stats["discards"] += 1
+        conn[1].close()
+
+
+# asyncio 连接只能在创建它的事件循环中使用，所以连接池按事件循环分开保存
+_http_pools = weakref.WeakKeyDictionary()
+
+def get_http_pool(http_host, scheme=None):
+    if scheme == None:
+        scheme = RTC_API_SCHEME
+    pools = _http_pools.setdefault(asyncio.get_running_loop(), {})
+    key = (scheme, http_host)
+    pool = pools.get(key)
+    if pool == None:
+        pool = AsyncHttpConnectionPool(http_host, scheme, RTC_HTTP_POOL_SIZE, RTC_HTTP_CONNECT_TIMEOUT, RTC_HTTP_READ_TIMEOUT)
+        pools[key] = pool
+    return pool
+
+def get_http_pool_stats():
+    pools = _http_pools.get(asyncio.get_running_loop(), {})
+    return dict((scheme + "://" + host, dict(pool.stats, idle=pool.idle_count())) for (scheme, host), pool in pools.items())
+
+async def request_rtc_api(http_host, http_request_method, canonical_uri, canonical_query_string, http_headers, http_body, AK, SK):
+    headers = RtcApiRequester.get_request_signer(http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK).sign(http_body)
+    if http_headers != None:
+        headers.update(http_headers)
+
+    url = canonical_uri + "?" + canonical_query_string
+    if http_request_method == "POST":
+        status, data = await get_http_pool(http_host).request("POST", url, http_body.encode("utf-8"), headers)
+    else:
+        status, data = await get_http_pool(http_host).request("GET", url, None, headers)
+
+    return (status, RtcApiRequester.parse_response(data))
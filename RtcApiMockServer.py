@@ -0,0 +1,208 @@
+# 火山引擎 RTC OpenAPI 的本地替身服务，用于离线压测
+# 支持 StartVoiceChat / StopVoiceChat / UpdateVoiceChat，按与 RtcApiRequester 相同的规则校验 HMAC-SHA256 Authorization，
+# 可以注入延迟、错误率和限流(QPS 令牌桶)。把 RtcAigcConfig 中的 RTC_API_SCHEME 改成 "http"，
+# RTC_API_HOST 改成 "127.0.0.1:端口" 即可让服务端请求本服务
+#
+# 用法: python RtcApiMockServer.py --port 9090 --latency-ms 50 --jitter-ms 20 --error-rate 0.01 --qps 200
+# GET /stats 返回各 action 的请求计数
+# 直接运行时仓库目录在 sys.path 最前面，先移到末尾，见 benchmarks/repo_path.py
+if __name__ == "__main__":
+    from benchmarks import repo_path
+
+import argparse
+import datetime
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+import RtcApiRequester
+
+from RtcAigcConfig import AK, SK
+
+MOCK_ACTIONS = ("StartVoiceChat", "StopVoiceChat", "UpdateVoiceChat")
+# X-Date 与本地时间允许的最大偏差，单位秒
+MAX_CLOCK_SKEW = 15 * 60
+
+
+class MockRtcApi:
+
+    def __init__(self, ak=AK, sk=SK, latency=0.0, jitter=0.0, error_rate=0.0, qps=0, verify_signature=True, seed=None):
+        self.ak = ak
+        self.sk = sk
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.qps = qps
+        self.verify_signature = verify_signature
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(qps)
+        self._refill_at = time.monotonic()
+        self.active_rooms = set()
+        self.stats = {}
+
+    # 返回 (http 状态码, 响应 json)
+    def handle(self, action, version, headers, body):
+        if action not in MOCK_ACTIONS:
+            return self.error(404, action, version, "InvalidActionOrVersion", "unknown action: " + str(action))
+        if self.verify_signature:
+            err = self.check_signature(headers, body)
+            if err != None:
+                return self.error(401, action, version, "SignatureDoesNotMatch", err)
+        if not self.take_token():
+            return self.error(429, action, version, "FlowLimitExceeded", "request qps exceeds limit " + str(self.qps))
+
+        delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter > 0 else self.latency
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            return self.error(500, action, version, "InternalError", "injected internal error")
+
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self.error(400, action, version, "InvalidParameter", "body is not json")
+        for field in ("AppId", "RoomId", "UserId"):
+            if field not in request:
+                return self.error(400, action, version, "MissingParameter", field + " is required")
+
+        with self._lock:
+            if action == "StartVoiceChat":
+                self.active_rooms.add(request["RoomId"])
+            elif action == "StopVoiceChat":
+                self.active_rooms.discard(request["RoomId"])
+            self.count(action, "ok")
+        return (200, {
+            "ResponseMetadata" : self.metadata(action, version),
+            "Result" : "ok"
+        })
+
+    def check_signature(self, headers, body):
+        x_date = headers.get("X-Date")
+        authorization = headers.get("Authorization")
+        host = headers.get("Host")
+        if not x_date or not authorization or not host:
+            return "X-Date, Authorization and Host headers are required"
+        try:
+            now = datetime.datetime.strptime(x_date, "%Y%m%dT%H%M%SZ")
+        except ValueError:
+            return "bad X-Date: " + x_date
+        if abs((datetime.datetime.utcnow() - now).total_seconds()) > MAX_CLOCK_SKEW:
+            return "X-Date out of range: " + x_date
+        if headers.get("X-Content-Sha256") != hashlib.sha256(body).hexdigest():
+            return "X-Content-Sha256 does not match body"
+        expected = RtcApiRequester.sign_request(host, headers["method"], headers["path"], headers["query"], body.decode("utf-8"), self.ak, self.sk, now)
+        if expected["Authorization"] != authorization:
+            return "signature does not match"
+        return None
+
+    def take_token(self):
+        if self.qps <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.qps), self._tokens + (now - self._refill_at) * self.qps)
+            self._refill_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def error(self, status, action, version, code, message):
+        with self._lock:
+            self.count(action, code)
+        metadata = self.metadata(action, version)
+        metadata["Error"] = {
+            "Code" : code,
+            "Message" : message
+        }
+        return (status, {"ResponseMetadata" : metadata})
+
+    def metadata(self, action, version):
+        return {
+            "RequestId" : uuid.uuid4().hex,
+            "Action" : action,
+            "Version" : version,
+            "Service" : RtcApiRequester.RTC_API_SERVICE,
+            "Region" : RtcApiRequester.RTC_API_REGION
+        }
+
+    def count(self, action, result):
+        counters = self.stats.setdefault(str(action), {})
+        counters[result] = counters.get(result, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "actions" : json.loads(json.dumps(self.stats)),
+                "active_rooms" : len(self.active_rooms)
+            }
+
+
+class MockRtcApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        headers = dict(self.headers.items())
+        headers["method"] = "POST"
+        headers["path"] = url.path or "/"
+        headers["query"] = url.query
+        status, resp = self.server.mock.handle(query.get("Action", [None])[0], query.get("Version", [None])[0], headers, body)
+        self.send_json(status, resp)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/stats":
+            self.send_json(200, self.server.mock.snapshot())
+        else:
+            self.send_json(404, {"msg" : "unknown path"})
+
+    def send_json(self, status, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockRtcApiServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, server_address, mock):
+        self.mock = mock
+        http.server.ThreadingHTTPServer.__init__(self, server_address, MockRtcApiHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="local stand-in for the RTC OpenAPI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9090)
+    parser.add_argument("--ak", default=AK)
+    parser.add_argument("--sk", default=SK)
+    parser.add_argument("--latency-ms", type=float, default=0, help="fixed latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random extra latency in [0, jitter]")
+    parser.add_argument("--error-rate", type=float, default=0, help="probability of an injected 500")
+    parser.add_argument("--qps", type=int, default=0, help="throttle above this rate with 429, 0 means unlimited")
+    parser.add_argument("--no-verify", action="store_true", help="skip Authorization verification")
+    args = parser.parse_args()
+
+    mock = MockRtcApi(args.ak, args.sk, args.latency_ms / 1000.0, args.jitter_ms / 1000.0, args.error_rate, args.qps, not args.no_verify)
+    with MockRtcApiServer((args.host, args.port), mock) as httpd:
+        print("mock rtc api serving at", args.host, args.port)
+        httpd.serve_forever()
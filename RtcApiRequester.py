@@ -1,7 +1,40 @@
 import datetime
 import hashlib
 import hmac
-import requests
+import json
+import threading
+
+import RtcHttpClient
+import RtcMetrics
+
+from RtcAigcConfig import RTC_API_SCHEME, RTC_HTTP_POOL_SIZE, RTC_HTTP_CONNECT_TIMEOUT, RTC_HTTP_READ_TIMEOUT
+
+# 每个 (scheme, host) 一个连接池，所有请求共享
+_http_pools = {}
+_http_pools_lock = threading.Lock()
+
+def get_http_pool(http_host, scheme=None):
+    if scheme == None:
+        scheme = RTC_API_SCHEME
+    key = (scheme, http_host)
+    pool = _http_pools.get(key)
+    if pool == None:
+        with _http_pools_lock:
+            pool = _http_pools.get(key)
+            if pool == None:
+                pool = RtcHttpClient.HttpConnectionPool(http_host, scheme, RTC_HTTP_POOL_SIZE, RTC_HTTP_CONNECT_TIMEOUT, RTC_HTTP_READ_TIMEOUT)
+                _http_pools[key] = pool
+    return pool
+
+def get_http_pool_stats():
+    with _http_pools_lock:
+        pools = list(_http_pools.items())
+    return dict((scheme + "://" + host, dict(pool.stats, idle=pool.idle_count())) for (scheme, host), pool in pools)
+
+def _http_pool_metrics():
+    return [((pool, stat), value) for pool, stats in get_http_pool_stats().items() for stat, value in stats.items()]
+
+RtcMetrics.registry.gauge("rtc_aigc_upstream_pool", "Upstream keep-alive connection pool counters.", ("pool", "stat"), _http_pool_metrics)
 
 def hash_sha256(content):
     return hashlib.sha256(content.encode("utf-8")).hexdigest()
@@ -9,57 +42,112 @@ def hash_sha256(content):
 def hmac_sha256(key, content):
     return hmac.new(key, content.encode("utf-8"), hashlib.sha256).digest()
 
-def request_rtc_api(http_host, http_request_method, canonical_uri, canonical_query_string, http_headers, http_body, AK, SK):
-    now = datetime.datetime.utcnow()
-
-    # 步骤1：创建规范请求
-    x_content_sha256 = hash_sha256(http_body)
-    x_date = now.strftime("%Y%m%dT%H%M%SZ")
-    content_type = "application/json"
-    signed_headers_vec = (
-        ("content-type", content_type), 
-        ("host", http_host), 
-        ("x-content-sha256", x_content_sha256), 
-        ("x-date", x_date)
-    )
-    canonical_headers = "\n".join((":".join(x) for x in signed_headers_vec)) + "\n"
-    signed_headers = ";".join((x[0] for x in signed_headers_vec))
-    canonical_request = http_request_method + "\n" + canonical_uri + "\n" + canonical_query_string + "\n" + canonical_headers + "\n" + signed_headers + "\n" + x_content_sha256
-    
-    # 步骤2：创建待签字符串
-    credential_scope = x_date[0:8] + "/cn-north-1/rtc/request"
-    string_to_sign = "HMAC-SHA256" + "\n" + x_date + "\n" + credential_scope + "\n" + hash_sha256(canonical_request)
-
-    # 步骤3：构建签名
-    hmac_contents = credential_scope.split("/")
-    hmac_contents.append(string_to_sign)
-    
-    signature = SK.encode("utf-8")
-    for hmac_content in hmac_contents:
-        signature = hmac_sha256(signature, hmac_content)
-    signature = signature.hex()
-    
-    # 步骤4：生成Authorization
-    authorization = "HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, Signature=%s" % (AK, credential_scope, signed_headers, signature)
-
-    # 步骤5：发起http请求
-    if canonical_uri == "/":
-        canonical_uri = ""
-    url = 'https://' + http_host + canonical_uri + "?" + canonical_query_string
-    headers = {
-        "Content-Type" : content_type, 
-        "Host" : http_host, 
-        "X-Content-Sha256": x_content_sha256, 
-        "X-Date": x_date,
-        "Authorization" : authorization
-    }
+RTC_API_REGION = "cn-north-1"
+RTC_API_SERVICE = "rtc"
+
+# 派生签名密钥缓存：(SK, 日期, region, service) -> 以派生密钥初始化好的 HMAC 对象
+# 同一天内只有 string_to_sign 会变，派生密钥 SK -> date -> region -> service -> "request" 只需要算一次
+_signing_keys = {}
+_signing_keys_lock = threading.Lock()
+
+def get_signing_hmac(SK, date, region=RTC_API_REGION, service=RTC_API_SERVICE):
+    key = (SK, date, region, service)
+    signing_hmac = _signing_keys.get(key)
+    if signing_hmac == None:
+        signing_key = SK.encode("utf-8")
+        for hmac_content in (date, region, service, "request"):
+            signing_key = hmac_sha256(signing_key, hmac_content)
+        signing_hmac = hmac.new(signing_key, None, hashlib.sha256)
+        with _signing_keys_lock:
+            # 跨天后淘汰更早日期的密钥，跨天瞬间仍在使用前一天日期的请求不受影响
+            for stale_key in [k for k in _signing_keys if k[1] < date]:
+                del _signing_keys[stale_key]
+            _signing_keys[key] = signing_hmac
+    return signing_hmac
+
+# 按火山引擎 OpenAPI 签名规则生成请求头，同步请求、异步请求和 mock 服务的签名校验共用这一份实现。
+# 固定 host / method / uri / query / AK 的签名器，规范请求中除 body 哈希和 X-Date 以外的部分预先拼好，
+# 每次请求只需要算 body 哈希、规范请求哈希和一次 HMAC
+class RequestSigner:
 
+    def __init__(self, http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK):
+        self.http_host = http_host
+        self.http_request_method = http_request_method
+        self.url = canonical_uri + "?" + canonical_query_string
+        self.SK = SK
+        # 规范请求中固定的部分，signed headers 为 content-type、host、x-content-sha256、x-date
+        self._canonical_prefix = "\n".join((http_request_method, canonical_uri, canonical_query_string,
+                                            "content-type:application/json", "host:" + http_host, "x-content-sha256:"))
+        self._signed_headers = "content-type;host;x-content-sha256;x-date"
+        self._scope_suffix = "/" + RTC_API_REGION + "/" + RTC_API_SERVICE + "/request"
+        self._authorization_prefix = "HMAC-SHA256 Credential=" + AK + "/"
+
+    def sign(self, http_body, now=None):
+        if now == None:
+            now = datetime.datetime.utcnow()
+        if http_body == None:
+            http_body = ""
+        # 步骤1：创建规范请求
+        x_content_sha256 = hash_sha256(http_body)
+        x_date = now.strftime("%Y%m%dT%H%M%SZ")
+        canonical_request = (self._canonical_prefix + x_content_sha256 + "\nx-date:" + x_date + "\n\n" +
+                             self._signed_headers + "\n" + x_content_sha256)
+        # 步骤2：创建待签字符串
+        credential_scope = x_date[0:8] + self._scope_suffix
+        string_to_sign = "HMAC-SHA256\n" + x_date + "\n" + credential_scope + "\n" + hash_sha256(canonical_request)
+        # 步骤3：构建签名，派生密钥按天缓存
+        signature = get_signing_hmac(self.SK, x_date[0:8]).copy()
+        signature.update(string_to_sign.encode("utf-8"))
+        # 步骤4：生成Authorization
+        return {
+            "Content-Type" : "application/json",
+            "Host" : self.http_host,
+            "X-Content-Sha256": x_content_sha256,
+            "X-Date": x_date,
+            "Authorization" : self._authorization_prefix + credential_scope + ", SignedHeaders=" + self._signed_headers + ", Signature=" + signature.hexdigest()
+        }
+
+# 单次签名，异步请求和 mock 服务的签名校验使用，与生产请求走同一个 RequestSigner
+def sign_request(http_host, http_request_method, canonical_uri, canonical_query_string, http_body, AK, SK, now=None):
+    return RequestSigner(http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK).sign(http_body, now)
+
+# (host, method, uri, query, AK, SK) -> RequestSigner，action 数量有限，不需要淘汰
+_request_signers = {}
+_request_signers_lock = threading.Lock()
+
+def get_request_signer(http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK):
+    key = (http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK)
+    signer = _request_signers.get(key)
+    if signer == None:
+        with _request_signers_lock:
+            signer = _request_signers.get(key)
+            if signer == None:
+                signer = RequestSigner(http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK)
+                _request_signers[key] = signer
+    return signer
+
+def parse_response(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+# timeout 不为 None 时作为本次请求的连接和读取超时(秒)，不超过配置的 RTC_HTTP_CONNECT_TIMEOUT / RTC_HTTP_READ_TIMEOUT
+def request_rtc_api(http_host, http_request_method, canonical_uri, canonical_query_string, http_headers, http_body, AK, SK, timeout=None):
+    signer = get_request_signer(http_host, http_request_method, canonical_uri, canonical_query_string, AK, SK)
+    return request_rtc_api_signed(signer, http_headers, http_body, timeout)
+
+def request_rtc_api_signed(signer, http_headers, http_body, timeout=None):
+    with RtcMetrics.span("sign_request"):
+        headers = signer.sign(http_body)
     if http_headers != None:
         headers.update(http_headers)
-    
-    if http_request_method == "POST":
-        response = requests.post(url, headers=headers, data=http_body)
-    else:
-        response = requests.get(url, headers=headers)
-    
-    return (response.status_code, response.json())
+
+    # 步骤5：发起http请求，复用连接池中的 keep-alive 连接
+    with RtcMetrics.span("upstream_request"):
+        if signer.http_request_method == "POST":
+            status, data = get_http_pool(signer.http_host).request("POST", signer.url, http_body.encode("utf-8"), headers, timeout)
+        else:
+            status, data = get_http_pool(signer.http_host).request("GET", signer.url, None, headers, timeout)
+
+    return (status, parse_response(data))
@@ -0,0 +1,158 @@
+# 上游熔断器
+# closed    : 正常放行，统计最近 window 秒内的失败率，请求数达到 min_requests 且失败率达到 failure_ratio 时打开
+# open      : 直接拒绝，不再等待上游超时，open_duration 秒后进入 half_open
+# half_open : 最多放行 half_open_probes 个探测请求，全部成功则关闭，任一失败则重新打开
+# 每次状态切换 generation 加 1，放行时记下当时的 generation，之前状态放行的请求迟到的结果不再影响当前状态
+import threading
+import time
+
+import RtcMetrics
+
+STATE_CLOSED = 0
+STATE_OPEN = 1
+STATE_HALF_OPEN = 2
+
+STATE_NAMES = {
+    STATE_CLOSED : "closed",
+    STATE_OPEN : "open",
+    STATE_HALF_OPEN : "half_open",
+}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_ratio=0.5, min_requests=20, window=10, open_duration=5.0, half_open_probes=3):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = int(window)
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.state = STATE_CLOSED
+        # 按秒分桶的 [秒, 成功数, 失败数]，环形使用
+        self._buckets = [[0, 0, 0] for _ in range(self.window)]
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    # 判断是否放行，拒绝返回 None，放行返回当前 generation，之后必须用它调用 record 上报结果
+    def allow(self):
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self._opened_at < self.open_duration:
+                    self.rejected += 1
+                    return None
+                self._transition(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return None
+                self._probes_in_flight += 1
+            return self._generation
+
+    # generation 为 allow 的返回值，与当前不一致说明请求在之前的状态放行，结果忽略
+    def record(self, generation, success):
+        with self._lock:
+            if generation != self._generation:
+                return
+            if self.state == STATE_HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not success:
+                    self._transition(STATE_OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(STATE_CLOSED)
+                return
+            if self.state == STATE_OPEN:
+                return
+
+            second = int(time.monotonic())
+            bucket = self._buckets[second % self.window]
+            if bucket[0] != second:
+                bucket[0], bucket[1], bucket[2] = second, 0, 0
+            bucket[1 if success else 2] += 1
+            if not success:
+                successes, failures = self._totals(second)
+                total = successes + failures
+                if total >= self.min_requests and failures >= total * self.failure_ratio:
+                    self._transition(STATE_OPEN)
+
+    # func() 返回结果，is_failure(result) 判断结果是否算失败，func 抛出的异常都算失败
+    def call(self, func, is_failure):
+        generation = self.allow()
+        if generation == None:
+            raise CircuitOpenError("circuit breaker open for " + self.name)
+        try:
+            result = func()
+        except BaseException:
+            self.record(generation, False)
+            raise
+        self.record(generation, not is_failure(result))
+        return result
+
+    def _totals(self, second):
+        successes = 0
+        failures = 0
+        for bucket_second, ok, failed in self._buckets:
+            if second - bucket_second < self.window:
+                successes += ok
+                failures += failed
+        return (successes, failures)
+
+    def _transition(self, state):
+        self.state = state
+        self._generation += 1
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+        elif state == STATE_CLOSED:
+            for bucket in self._buckets:
+                bucket[0], bucket[1], bucket[2] = 0, 0, 0
+
+
+class CircuitBreakers:
+    # 按名称(action)各自一个熔断器
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        breaker = self._breakers.get(name)
+        if breaker == None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker == None:
+                    breaker = CircuitBreaker(name, **self.options)
+                    self._breakers[name] = breaker
+        return breaker
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return dict((b.name, STATE_NAMES[b.state]) for b in breakers)
+
+    def metrics(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [((b.name,), b.state) for b in breakers]
+
+    def rejected_metrics(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [((b.name,), b.rejected) for b in breakers]
+
+
+def register_metrics(breakers, prefix="rtc_aigc_upstream_circuit"):
+    RtcMetrics.registry.gauge(prefix + "_state", "Circuit breaker state per action: 0 closed, 1 open, 2 half-open.", ("action",), breakers.metrics)
+    RtcMetrics.registry.gauge(prefix + "_rejected", "Requests rejected by the open circuit breaker per action.", ("action",), breakers.rejected_metrics)
@@ -0,0 +1,124 @@
+# 预生成的房间凭证池
+# 后台线程批量生成 (room_id, uid, token)，start 请求直接取用，生成 token 不再占用 start 的耗时。
+# 池中数量低于 low_watermark 时补充到 high_watermark；token 有效期从生成时开始计算，
+# 生成超过 max_age 秒的凭证直接丢弃，保证发给设备的 token 剩余有效期不少于 expire_seconds - max_age
+import collections
+import threading
+import time
+import uuid
+
+import AccessToken
+import RtcLog
+import RtcMetrics
+
+credential_pool_total = RtcMetrics.registry.counter("rtc_aigc_credential_pool_total", "Room credential requests by result (hit / miss / expired).", ("result",))
+
+
+class Credential:
+    __slots__ = ("room_id", "uid", "token", "created_at", "expire_at")
+
+    def __init__(self, room_id, uid, token, created_at, expire_at):
+        self.room_id = room_id
+        self.uid = uid
+        self.token = token
+        self.created_at = created_at
+        self.expire_at = expire_at
+
+
+class CredentialPool:
+
+    def __init__(self, app_id, app_key, expire_seconds, low_watermark=32, high_watermark=128, max_age=600, batch_size=32):
+        self.app_id = app_id
+        self.app_key = app_key
+        self.expire_seconds = expire_seconds
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.max_age = max_age
+        self.batch_size = batch_size
+        # 先生成的在左边，从左边取用和淘汰
+        self._credentials = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    # 生成 count 个凭证，room_id 以 G711A 开头，音频编码格式为 g711a
+    def mint(self, count, now=None):
+        if now == None:
+            now = time.time()
+        issued_at = int(now)
+        expire_at = issued_at + self.expire_seconds
+        pairs = []
+        for _ in range(count):
+            uuid_str = uuid.uuid4().hex
+            pairs.append(("G711A" + uuid_str, "user" + uuid_str))
+        tokens = AccessToken.mint_tokens(self.app_id, self.app_key, pairs, expire_at,
+                                         (AccessToken.PrivSubscribeStream, AccessToken.PrivPublishStream), issued_at)
+        return [Credential(room_id, uid, token, issued_at, expire_at) for (room_id, uid), token in zip(pairs, tokens)]
+
+    # 取一个凭证，池为空时当场生成一个
+    def take(self, now=None):
+        if now == None:
+            now = time.time()
+        self.start()
+        credential = None
+        with self._cond:
+            self._discard_stale(now)
+            if self._credentials:
+                credential = self._credentials.popleft()
+            if len(self._credentials) < self.low_watermark:
+                self._cond.notify()
+        if credential != None:
+            credential_pool_total.inc(("hit",))
+            return credential
+        credential_pool_total.inc(("miss",))
+        return self.mint(1, now)[0]
+
+    def size(self):
+        with self._cond:
+            return len(self._credentials)
+
+    # 启动后台补充线程，重复调用无影响
+    def start(self):
+        if self._thread != None:
+            return
+        with self._cond:
+            if self._thread != None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="rtc-credential-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread != None:
+            thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # 没人取用时也定期醒来淘汰过旧的凭证
+                while not self._stopped and len(self._credentials) >= self.low_watermark:
+                    self._cond.wait(self.max_age / 2.0)
+                    self._discard_stale(time.time())
+                if self._stopped:
+                    return
+            try:
+                while not self._stopped and self.size() < self.high_watermark:
+                    credentials = self.mint(min(self.batch_size, self.high_watermark - self.size()))
+                    with self._cond:
+                        self._credentials.extend(credentials)
+            except Exception:
+                RtcLog.exception("credential_pool_refill_error")
+                time.sleep(1)
+
+    def _discard_stale(self, now):
+        discarded = 0
+        while self._credentials and now - self._credentials[0].created_at > self.max_age:
+            self._credentials.popleft()
+            discarded += 1
+        if discarded:
+            credential_pool_total.inc(("expired",), discarded)
@@ -0,0 +1,127 @@
+# 带连接池的 keep-alive HTTP/HTTPS 客户端
+# 每个 HttpConnectionPool 对应一个 scheme + host，空闲连接放回池中复用，
+# 复用连接时省去 TCP + TLS 握手，请求只需要一次往返
+import collections
+import http.client
+import ssl
+import threading
+
+# 复用的空闲连接可能已经被服务端关闭，这些异常出现时换新连接重试一次
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+# 建立连接失败(连接被拒绝、连接超时、TLS 握手失败等)，请求还没有发出，非幂等请求也可以安全重试
+class ConnectError(OSError):
+    pass
+
+
+class HttpConnectionPool:
+
+    def __init__(self, host, scheme="https", pool_size=8, connect_timeout=3.0, read_timeout=10.0, ssl_context=None):
+        if scheme not in ("http", "https"):
+            raise ValueError("unsupported scheme: " + scheme)
+        self.host = host
+        self.scheme = scheme
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        if scheme == "https" and ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        self.ssl_context = ssl_context
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        # hits: 复用空闲连接 misses: 新建连接 discards: 池满或服务端要求关闭而丢弃的连接 retries: 复用失效连接后的重试
+        self.stats = {
+            "hits" : 0,
+            "misses" : 0,
+            "discards" : 0,
+            "retries" : 0,
+        }
+
+    # timeout 为本次请求的截止秒数(调用方剩余的截止时间)，连接和读取超时都不超过它
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        conn, reused = self._get_connection(timeout)
+        try:
+            response, data = self._do_request(conn, method, url, body, headers)
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            with self._lock:
+                self.stats["retries"] += 1
+            conn = self._new_connection(timeout)
+            try:
+                response, data = self._do_request(conn, method, url, body, headers)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+            with self._lock:
+                self.stats["discards"] += 1
+        else:
+            if timeout != None:
+                conn.sock.settimeout(self.read_timeout)
+            self._put_connection(conn)
+        return (response.status, data)
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def idle_count(self):
+        with self._lock:
+            return len(self._idle)
+
+    def _do_request(self, conn, method, url, body, headers):
+        conn.request(method, url, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return (response, response.read())
+
+    def _get_connection(self, timeout=None):
+        conn = None
+        with self._lock:
+            if self._idle:
+                self.stats["hits"] += 1
+                conn = self._idle.pop()
+        if conn == None:
+            return (self._new_connection(timeout), False)
+        if timeout != None:
+            conn.sock.settimeout(min(self.read_timeout, timeout))
+        return (conn, True)
+
+    def _new_connection(self, timeout=None):
+        with self._lock:
+            self.stats["misses"] += 1
+        connect_timeout = self.connect_timeout if timeout == None else min(self.connect_timeout, timeout)
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, timeout=connect_timeout, context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(self.host, timeout=connect_timeout)
+        try:
+            conn.connect()
+        except OSError as e:
+            conn.close()
+            raise ConnectError("connect to %s failed: %s" % (self.host, e)) from e
+        # 连接建立后切换为读超时
+        conn.sock.settimeout(self.read_timeout if timeout == None else min(self.read_timeout, timeout))
+        return conn
+
+    def _put_connection(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+            self.stats["discards"] += 1
+        conn.close()
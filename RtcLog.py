@@ -0,0 +1,127 @@
+# 结构化日志
+# 请求线程只负责判断级别和采样、把日志记录放进有界队列，格式化(json)、脱敏和写 stdout 都在后台线程完成，
+# 队列满时直接丢弃并计数，不阻塞请求。
+#     RtcLog.info("rtc_api_response", action="StartVoiceChat", code=200, response=response)
+# 高频事件可以在 LOG_SAMPLE_RATES 中配置采样率，WARNING 及以上级别不采样
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+import RtcMetrics
+
+from RtcAigcConfig import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+
+# 字段名包含这些词时值会被替换，不输出原文
+REDACT_KEYWORDS = ("token", "authorization", "secret", "password")
+REDACTED = "***"
+
+logger = logging.getLogger("rtc_aigc")
+logger.propagate = False
+
+dropped_total = RtcMetrics.registry.counter("rtc_aigc_log_dropped_total", "Log records dropped because the log queue was full.")
+
+
+def redact(value):
+    if isinstance(value, dict):
+        result = {}
+        for k, v in value.items():
+            if isinstance(k, str) and any(word in k.lower() for word in REDACT_KEYWORDS) and not isinstance(v, (dict, list)):
+                result[k] = REDACTED
+            else:
+                result[k] = redact(v)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts" : datetime.datetime.utcfromtimestamp(record.created).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "level" : record.levelname,
+            "event" : record.getMessage(),
+            "thread" : record.threadName,
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_total.inc()
+
+    # 默认的 prepare 会在请求线程里格式化消息，这里留给后台线程
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def setup(level=LOG_LEVEL, stream=None, queue_size=LOG_QUEUE_SIZE):
+    global _listener
+    shutdown()
+    output = logging.StreamHandler(stream if stream != None else sys.stdout)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(queue_size)
+    logger.handlers = [NonBlockingQueueHandler(log_queue)]
+    logger.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+# 停止后台线程，队列中剩余的日志会先写完
+def shutdown():
+    global _listener
+    if _listener != None:
+        _listener.stop()
+        _listener = None
+
+
+def log(level, event, exc_info=None, **fields):
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING:
+        rate = LOG_SAMPLE_RATES.get(event)
+        if rate != None and random.random() >= rate:
+            return
+    logger.log(level, event, exc_info=exc_info, extra={"fields" : fields})
+
+
+def debug(event, **fields):
+    log(logging.DEBUG, event, **fields)
+
+
+def info(event, **fields):
+    log(logging.INFO, event, **fields)
+
+
+def warning(event, **fields):
+    log(logging.WARNING, event, **fields)
+
+
+def error(event, **fields):
+    log(logging.ERROR, event, **fields)
+
+
+def exception(event, **fields):
+    log(logging.ERROR, event, exc_info=True, **fields)
+
+
+setup()
+atexit.register(shutdown)
@@ -0,0 +1,209 @@
+# 服务端指标，按 Prometheus 文本格式在 /metrics 输出
+# 请求处理的每个阶段(解析请求、生成 token、签名、上游请求...)用 span 计时，记录到 rtc_aigc_stage_seconds 直方图。
+# METRICS_ENABLED = False 时 span 返回共享的空对象，不读时钟也不加锁
+import bisect
+import threading
+import time
+
+from RtcAigcConfig import METRICS_ENABLED
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def format_labels(names, values, extra=None):
+    pairs = ["%s=\"%s\"" % (n, escape_label_value(v)) for n, v in zip(names, values)]
+    if extra != None:
+        pairs.append("%s=\"%s\"" % extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(self.name + format_labels(self.labelnames, labels) + " " + format_value(value))
+        return lines
+
+
+class Gauge:
+    # func 在输出时调用，返回 [(labels, value), ...]
+    def __init__(self, name, help, labelnames=(), func=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s gauge" % self.name]
+        with self._lock:
+            items = list(self._values.items())
+        if self.func != None:
+            items.extend(self.func())
+        for labels, value in sorted(items):
+            lines.append(self.name + format_labels(self.labelnames, labels) + " " + format_value(value))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [每个桶的计数(非累计)..., +Inf 桶计数, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series == None:
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self._series[labels] = series
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, labels=()):
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[:-1]) if series != None else 0
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                lines.append(self.name + "_bucket" + format_labels(self.labelnames, labels, ("le", format_value(float(bound)))) + " " + str(cumulative))
+            lines.append(self.name + "_sum" + format_labels(self.labelnames, labels) + " " + repr(series[-1]))
+            lines.append(self.name + "_count" + format_labels(self.labelnames, labels) + " " + str(cumulative))
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), func=None):
+        return self.register(Gauge(name, help, labelnames, func))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.histogram("rtc_aigc_stage_seconds", "Time spent in each stage of a request.", ("path", "stage"))
+
+# 当前线程正在处理的请求路径，RtcApiRequester 等不知道请求路径的模块记录 span 时使用
+_context = threading.local()
+
+
+def set_path(path):
+    _context.path = path
+
+
+def current_path():
+    return getattr(_context, "path", "")
+
+
+class _Span:
+    __slots__ = ("stage", "path", "begin")
+
+    def __init__(self, stage, path):
+        self.stage = stage
+        self.path = path
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        path = self.path if self.path != None else current_path()
+        stage_seconds.observe(time.perf_counter() - self.begin, (path, self.stage))
+        return False
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# with RtcMetrics.span("sign_request"): ...
+def span(stage, path=None):
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(stage, path)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render():
+    return registry.render()
@@ -0,0 +1,102 @@
+# 上游请求并发闸门
+# 同时在途的上游请求最多 max_concurrent 个，满了以后按优先级排队(数值越小越优先，同优先级先到先得)，
+# 释放时把名额直接交给最优先的等待者，保证打断(interrupt)不会排在大量 start / stop 后面。
+# max_concurrent <= 0 表示不限制
+import heapq
+import itertools
+import threading
+
+PRIORITY_INTERRUPT = 0
+PRIORITY_UPDATE = 1
+PRIORITY_DEFAULT = 2
+
+
+class GateTimeoutError(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class PriorityGate:
+
+    def __init__(self, max_concurrent=64):
+        self.max_concurrent = max_concurrent
+        self._available = max_concurrent
+        # 堆中元素 (priority, 序号, _Waiter)，超时的等待者只标记 cancelled，释放时跳过
+        self._waiters = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.timeouts = 0
+
+    # 获取一个名额，timeout 秒内没有拿到返回 False
+    def acquire(self, priority=PRIORITY_DEFAULT, timeout=None):
+        if self.max_concurrent <= 0:
+            return True
+        with self._lock:
+            if self._available > 0:
+                self._available -= 1
+                return True
+            waiter = _Waiter()
+            heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+            self.waiting += 1
+
+        if waiter.event.wait(timeout):
+            return True
+        with self._lock:
+            # 超时和释放同时发生时名额已经交给了这个等待者
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self.waiting -= 1
+            self.timeouts += 1
+            return False
+
+    def release(self):
+        if self.max_concurrent <= 0:
+            return
+        with self._lock:
+            while self._waiters:
+                waiter = heapq.heappop(self._waiters)[2]
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self.waiting -= 1
+                waiter.event.set()
+                return
+            self._available += 1
+
+    def in_flight(self):
+        if self.max_concurrent <= 0:
+            return 0
+        with self._lock:
+            return self.max_concurrent - self._available
+
+    # with gate.slot(priority, timeout): ...  拿不到名额时抛出 GateTimeoutError
+    def slot(self, priority=PRIORITY_DEFAULT, timeout=None):
+        return _Slot(self, priority, timeout)
+
+
+class _Slot:
+    __slots__ = ("gate", "priority", "timeout")
+
+    def __init__(self, gate, priority, timeout):
+        self.gate = gate
+        self.priority = priority
+        self.timeout = timeout
+
+    def __enter__(self):
+        if not self.gate.acquire(self.priority, self.timeout):
+            raise GateTimeoutError("upstream busy, no slot within %.3fs" % self.timeout)
+        return self
+
+    def __exit__(self, *args):
+        self.gate.release()
+        return False
@@ -0,0 +1,48 @@
+# 令牌桶限流
+# 每个 key 一个桶，每秒补充 rate 个令牌，最多 burst 个，每个请求消耗 1 个。
+# 桶保存在 LRU 中，最多 max_keys 个，超过时淘汰最久没有请求的 key(被淘汰的 key 下次请求时桶是满的)，
+# 每个桶只占 [令牌数, 更新时间] 两个数，内存不随设备数量无限增长
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # 允许返回 0，否则返回还需要等待的秒数
+    def acquire(self, key, now=None):
+        if self.rate <= 0:
+            return 0
+        if now == None:
+            now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket == None:
+                bucket = [self.burst, now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Retry-After 头的值，向上取整到秒，至少 1 秒
+def retry_after_header(seconds):
+    return str(max(1, int(math.ceil(seconds))))
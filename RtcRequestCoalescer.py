@@ -0,0 +1,92 @@
+# 相同 key 的请求合并
+# 同一个 key 同时只有一个调用真正执行，其余并发请求等待并共享它的结果；
+# 成功的结果在 replay_window 秒内对同 key 的重复请求直接重放，失败的结果只共享给并发等待者，不重放
+import threading
+import time
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "done_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.done_at = None
+
+
+class RequestCoalescer:
+
+    def __init__(self, replay_window=60.0, max_entries=10000):
+        self.replay_window = replay_window
+        self.max_entries = max_entries
+        # key -> _Call，按插入顺序保存，淘汰时从最早的开始
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "executed" : 0,
+            "coalesced" : 0,
+            "replayed" : 0,
+        }
+
+    # 执行 func() 并返回 (结果, 是否为共享的结果)
+    # replay_if(result) 返回 False 的结果不会在 replay_window 内重放
+    def do(self, key, func, replay_if=None):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            call = self._calls.get(key)
+            if call != None:
+                if call.done_at == None:
+                    self.stats["coalesced"] += 1
+                else:
+                    self.stats["replayed"] += 1
+                owner = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats["executed"] += 1
+                owner = True
+
+        if not owner:
+            call.event.wait()
+            if call.error != None:
+                raise call.error
+            return (call.result, True)
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+        replay = call.error == None and (replay_if == None or replay_if(call.result))
+        with self._lock:
+            call.done_at = time.monotonic()
+            if not replay and self._calls.get(key) is call:
+                del self._calls[key]
+        call.event.set()
+        if call.error != None:
+            raise call.error
+        return (call.result, False)
+
+    def forget(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call != None and call.done_at != None:
+                del self._calls[key]
+
+    def _evict(self, now):
+        # 字典按开始顺序遍历，完成时间大致递增，遇到未过期的就停止；
+        # 超过 max_entries 时跳过进行中的调用，继续淘汰已完成的
+        over = len(self._calls) - self.max_entries
+        expired = []
+        for key, call in self._calls.items():
+            if call.done_at == None or now - call.done_at < self.replay_window:
+                if len(expired) < over and call.done_at != None:
+                    expired.append(key)
+                    continue
+                if len(expired) < over:
+                    continue
+                break
+            expired.append(key)
+        for key in expired:
+            del self._calls[key]
@@ -0,0 +1,100 @@
+# 上游请求重试
+# 对临时错误(5xx、429 限流、连接异常)按指数退避 + 随机抖动(full jitter)重试，
+# 每个请求有总的截止时间，所有请求共享一个重试预算，避免上游故障时重试放大流量(重试风暴)
+import http.client
+import random
+import threading
+import time
+
+import RtcHttpClient
+import RtcMetrics
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = (OSError, http.client.HTTPException)
+# 非幂等请求读超时或 5xx 时上游可能已经处理，只重试请求肯定没有被处理的情况: 连接没有建立、429 限流
+NON_IDEMPOTENT_RETRYABLE_STATUS = (429,)
+NON_IDEMPOTENT_RETRYABLE_ERRORS = (RtcHttpClient.ConnectError,)
+
+retries_total = RtcMetrics.registry.counter("rtc_aigc_upstream_retries_total", "Upstream retries by action and reason.", ("action", "reason"))
+retry_budget_exhausted_total = RtcMetrics.registry.counter("rtc_aigc_upstream_retry_budget_exhausted_total", "Retries skipped because the retry budget was empty.", ("action",))
+
+
+class RetryBudget:
+    # 每个请求存入 ratio 个令牌，每次重试取出 1 个，另外每秒固定补充 min_per_second 个，保证低流量时也能重试。
+    # 持续的重试速率不超过 min_per_second + ratio * 请求速率，令牌上限 capacity 限制突发的重试数量
+    def __init__(self, ratio=0.1, min_per_second=10, capacity=100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+
+class RetryPolicy:
+
+    # retry_status / retry_errors 为需要重试的状态码和异常，其它异常直接抛出
+    def __init__(self, max_attempts=3, base_delay=0.05, max_delay=1.0, deadline=5.0, budget=None,
+                 retry_status=RETRYABLE_STATUS, retry_errors=RETRYABLE_ERRORS):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.budget = budget
+        self.retry_status = retry_status
+        self.retry_errors = retry_errors
+
+    # func(timeout) 返回 (code, response)，timeout 为距截止时间的剩余秒数，单次尝试不应超过它
+    # code 为可重试状态码或抛出连接类异常时重试
+    # 重试次数、截止时间或重试预算用完后返回最后一次结果或抛出最后一次异常
+    def call(self, func, action="", deadline=None):
+        if deadline == None:
+            deadline = self.deadline
+        deadline_at = time.monotonic() + deadline
+        if self.budget != None:
+            self.budget.deposit()
+
+        attempt = 0
+        while True:
+            attempt += 1
+            error = None
+            try:
+                result = func(max(0.0, deadline_at - time.monotonic()))
+                if result[0] not in self.retry_status:
+                    return result
+                reason = str(result[0])
+            except self.retry_errors as e:
+                error = e
+                reason = type(e).__name__
+
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+            if attempt >= self.max_attempts or time.monotonic() + delay >= deadline_at:
+                return self._give_up(result if error == None else None, error)
+            if self.budget != None and not self.budget.withdraw():
+                retry_budget_exhausted_total.inc((action,))
+                return self._give_up(result if error == None else None, error)
+            retries_total.inc((action, reason))
+            time.sleep(delay)
+
+    def _give_up(self, result, error):
+        if error != None:
+            raise error
+        return result
@@ -0,0 +1,61 @@
+# 空闲会话回收
+# 设备断电或断网后不会调用 /stopvoicechat，云端智能体会一直运行到上游超时。
+# 后台线程每 interval 秒从会话注册表取出 idle_timeout 秒内没有请求过本服务的会话，调用 stop_func 停止智能体。
+# 注册表按最近活跃时间用堆排序，每次只看堆顶，会话数量很多时也不需要遍历
+import threading
+
+import RtcLog
+import RtcMetrics
+
+reaped_total = RtcMetrics.registry.counter("rtc_aigc_sessions_reaped_total", "Idle sessions stopped by the session reaper.")
+
+
+class SessionReaper:
+
+    # stop_func(session) 停止会话对应的智能体
+    def __init__(self, registry, stop_func, idle_timeout=3600, interval=30, batch_size=1000):
+        self.registry = registry
+        self.stop_func = stop_func
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # 回收一轮，返回回收的会话数
+    def reap(self, now=None):
+        reaped = 0
+        while True:
+            sessions = self.registry.pop_idle(self.idle_timeout, now, self.batch_size)
+            for session in sessions:
+                RtcLog.info("session_reaped", room_id=session.room_id, device_id=session.device_id, last_active=session.last_active)
+                try:
+                    self.stop_func(session)
+                except Exception:
+                    RtcLog.exception("session_reaper_error", room_id=session.room_id)
+            reaped += len(sessions)
+            if len(sessions) < self.batch_size:
+                break
+        if reaped:
+            reaped_total.inc(amount=reaped)
+        return reaped
+
+    def start(self):
+        if self._thread != None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="rtc-session-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread != None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception:
+                RtcLog.exception("session_reaper_error")
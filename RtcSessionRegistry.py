@@ -0,0 +1,178 @@
+# 进程内的会话注册表
+# 记录通过本服务 StartVoiceChat 成功的会话，按 room_id / uid / device_id 建索引，O(1) 查询，
+# 过期时间与 token 有效期一致，到期后自动淘汰。
+# stop / update 可以在本地校验 app_id、room_id、uid，同一设备以相同的 profile(bot_id, voice_id)重复 start 可以直接返回已有会话。
+# pop_idle 按最近活跃时间取出空闲会话，供回收空闲会话使用
+import heapq
+import threading
+import time
+
+
+class Session:
+    __slots__ = ("room_id", "uid", "app_id", "token", "device_id", "profile", "created_at", "expire_at", "last_active")
+
+    def __init__(self, room_id, uid, app_id, token, device_id, expire_at, now, profile=None):
+        self.room_id = room_id
+        self.uid = uid
+        self.app_id = app_id
+        self.token = token
+        self.device_id = device_id
+        self.profile = profile
+        self.created_at = now
+        self.expire_at = expire_at
+        self.last_active = now
+
+    def room_info(self):
+        return {
+            "room_id" : self.room_id,
+            "uid" : self.uid,
+            "app_id" : self.app_id,
+            "token" : self.token
+        }
+
+
+class SessionRegistry:
+
+    def __init__(self, ttl=3600 * 48):
+        self.ttl = ttl
+        self._by_room = {}
+        self._by_uid = {}
+        self._by_device = {}
+        # (expire_at, room_id) 小顶堆，淘汰时只看堆顶，不需要遍历全部会话
+        self._expiry = []
+        # (记录时的 last_active, room_id) 小顶堆，touch 不入堆，取出时发现会话后来活跃过再按新的时间放回
+        self._activity = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_room)
+
+    # room_info 为 generate_rtc_room_info 的返回值，expire_at 默认为当前时间 + ttl，profile 为启动智能体时的 (bot_id, voice_id)
+    def add(self, room_info, device_id=None, expire_at=None, now=None, profile=None):
+        if now == None:
+            now = time.time()
+        if expire_at == None:
+            expire_at = now + self.ttl
+        session = Session(room_info["room_id"], room_info["uid"], room_info["app_id"], room_info["token"], device_id, expire_at, now, profile)
+        with self._lock:
+            self._evict_expired(now)
+            old = self._by_room.get(session.room_id)
+            if old != None:
+                self._unindex(old)
+            if device_id != None:
+                old = self._by_device.get(device_id)
+                if old != None:
+                    self._unindex(old)
+            self._by_room[session.room_id] = session
+            self._by_uid[session.uid] = session
+            if device_id != None:
+                self._by_device[device_id] = session
+            heapq.heappush(self._expiry, (expire_at, session.room_id))
+            heapq.heappush(self._activity, (now, session.room_id))
+        return session
+
+    def get_by_room(self, room_id, now=None):
+        with self._lock:
+            return self._live(self._by_room.get(room_id), now)
+
+    def get_by_uid(self, uid, now=None):
+        with self._lock:
+            return self._live(self._by_uid.get(uid), now)
+
+    def get_by_device(self, device_id, now=None):
+        with self._lock:
+            return self._live(self._by_device.get(device_id), now)
+
+    # 更新会话最近活跃时间，会话不存在返回 None
+    def touch(self, room_id, now=None):
+        if now == None:
+            now = time.time()
+        with self._lock:
+            session = self._live(self._by_room.get(room_id), now)
+            if session != None:
+                session.last_active = now
+            return session
+
+    def remove(self, room_id):
+        with self._lock:
+            session = self._by_room.get(room_id)
+            if session != None:
+                self._unindex(session)
+                self._compact_expiry()
+            return session
+
+    # 校验 stop / update 请求中的 app_id、uid 是否属于 room_id 对应的会话，通过返回 None，否则返回错误信息。
+    # 注册表中没有的会话(服务重启前、其它实例或进程启动的)不能判断，也返回 None，由上游校验
+    def validate(self, app_id, room_id, uid, now=None):
+        session = self.get_by_room(room_id, now)
+        if session == None:
+            return None
+        if session.uid != uid or session.app_id != app_id:
+            return "session mismatch, \"app_id\" or \"uid\" does not belong to room_id: " + str(room_id)
+        return None
+
+    # 删除并返回最近 idle_timeout 秒内没有活跃过的会话，最多 limit 个
+    def pop_idle(self, idle_timeout, now=None, limit=1000):
+        if now == None:
+            now = time.time()
+        cutoff = now - idle_timeout
+        idle = []
+        with self._lock:
+            self._evict_expired(now)
+            while self._activity and self._activity[0][0] <= cutoff and len(idle) < limit:
+                last_active, room_id = heapq.heappop(self._activity)
+                session = self._by_room.get(room_id)
+                if session == None:
+                    continue
+                if session.last_active > last_active:
+                    heapq.heappush(self._activity, (session.last_active, room_id))
+                    continue
+                self._unindex(session)
+                idle.append(session)
+            self._compact_expiry()
+        return idle
+
+    def evict_expired(self, now=None):
+        if now == None:
+            now = time.time()
+        with self._lock:
+            return self._evict_expired(now)
+
+    def _live(self, session, now):
+        if session == None:
+            return None
+        if now == None:
+            now = time.time()
+        if session.expire_at <= now:
+            self._unindex(session)
+            return None
+        return session
+
+    def _evict_expired(self, now):
+        evicted = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expire_at, room_id = heapq.heappop(self._expiry)
+            session = self._by_room.get(room_id)
+            # 会话可能已经被删除或以新的过期时间重新加入，只淘汰过期时间一致的
+            if session != None and session.expire_at == expire_at:
+                self._unindex(session)
+                evicted += 1
+        return evicted
+
+    # 被 remove 的会话在堆中留下的记录要到过期(或空闲)时才会弹出，积压过多时重建堆
+    def _compact_expiry(self):
+        if len(self._expiry) > 2 * len(self._by_room) + 1024:
+            self._expiry = [(s.expire_at, s.room_id) for s in self._by_room.values()]
+            heapq.heapify(self._expiry)
+        if len(self._activity) > 2 * len(self._by_room) + 1024:
+            self._activity = [(s.last_active, s.room_id) for s in self._by_room.values()]
+            heapq.heapify(self._activity)
+
+    def _unindex(self, session):
+        if self._by_room.get(session.room_id) is session:
+            del self._by_room[session.room_id]
+        if self._by_uid.get(session.uid) is session:
+            del self._by_uid[session.uid]
+        if session.device_id != None and self._by_device.get(session.device_id) is session:
+            del self._by_device[session.device_id]
@@ -0,0 +1,136 @@
+# 后台 StopVoiceChat 队列
+# stop 请求入队后立即回复设备，后台线程按固定速率(rate 次/秒)调用上游，大量设备同时挂断时也不会突发打满上游。
+# 同一房间在队列中或正在执行时重复提交会被合并；失败按 retry_delay 指数退避重试，最多 max_attempts 次
+import heapq
+import itertools
+import threading
+import time
+
+import RtcLog
+import RtcMetrics
+
+stop_queue_total = RtcMetrics.registry.counter("rtc_aigc_stop_queue_total", "Queued stops by result (queued / deduplicated / rejected / ok / retry / failed).", ("result",))
+
+
+class StopTask:
+    __slots__ = ("room_id", "payload", "attempts")
+
+    def __init__(self, room_id, payload):
+        self.room_id = room_id
+        self.payload = payload
+        self.attempts = 0
+
+
+class StopQueue:
+
+    # stop_func(payload) 成功返回 None，失败返回错误信息
+    def __init__(self, stop_func, workers=2, rate=20.0, max_attempts=5, retry_delay=2.0, max_pending=10000):
+        self.stop_func = stop_func
+        self.workers = workers
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_pending = max_pending
+        # 堆中元素 (可执行时间, 序号, StopTask)
+        self._heap = []
+        self._seq = itertools.count()
+        # 队列中和正在执行的房间
+        self._rooms = set()
+        self._next_slot = 0.0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    # 入队成功返回 True，同一房间已在处理中也返回 True；队列已满返回 False，由调用方同步处理
+    def submit(self, room_id, payload):
+        self.start()
+        with self._cond:
+            if room_id in self._rooms:
+                stop_queue_total.inc(("deduplicated",))
+                return True
+            if len(self._heap) >= self.max_pending:
+                stop_queue_total.inc(("rejected",))
+                return False
+            self._rooms.add(room_id)
+            heapq.heappush(self._heap, (time.monotonic(), next(self._seq), StopTask(room_id, payload)))
+            self._cond.notify()
+        stop_queue_total.inc(("queued",))
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def start(self):
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name="rtc-stop-queue-%d" % i, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # 停止后台线程，wait_seconds 内尽量处理完队列中已经可以执行的任务
+    def stop(self, wait_seconds=0):
+        deadline = time.monotonic() + wait_seconds
+        with self._cond:
+            while self._heap and self._heap[0][0] <= time.monotonic() and time.monotonic() < deadline:
+                self._cond.wait(min(0.1, max(0, deadline - time.monotonic())))
+            self._stopped = True
+            self._cond.notify_all()
+            threads = self._threads
+            self._threads = []
+        for thread in threads:
+            thread.join()
+
+    def _take(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    task = heapq.heappop(self._heap)[2]
+                    # 所有工作线程共享速率，每个任务占一个 1/rate 秒的时间片
+                    slot = max(now, self._next_slot)
+                    self._next_slot = slot + 1.0 / self.rate if self.rate > 0 else now
+                    self._cond.notify_all()
+                    return (task, slot)
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            taken = self._take()
+            if taken == None:
+                return
+            task, slot = taken
+            delay = slot - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            task.attempts += 1
+            try:
+                err = self.stop_func(task.payload)
+            except Exception as e:
+                RtcLog.exception("stop_queue_error", room_id=task.room_id)
+                err = repr(e)
+            self._finish(task, err)
+
+    def _finish(self, task, err):
+        with self._cond:
+            if err == None or task.attempts >= self.max_attempts:
+                self._rooms.discard(task.room_id)
+            else:
+                retry_at = time.monotonic() + self.retry_delay * (2 ** (task.attempts - 1))
+                heapq.heappush(self._heap, (retry_at, next(self._seq), task))
+                self._cond.notify()
+        if err == None:
+            stop_queue_total.inc(("ok",))
+        elif task.attempts >= self.max_attempts:
+            stop_queue_total.inc(("failed",))
+            RtcLog.error("stop_queue_failed", room_id=task.room_id, attempts=task.attempts, error=err)
+        else:
+            stop_queue_total.inc(("retry",))
+            RtcLog.warning("stop_queue_retry", room_id=task.room_id, attempts=task.attempts, error=err)
@@ -0,0 +1,67 @@
+# function calling 工具结果缓存
+# 键为 (工具名, 规范化后的参数)，参数按 key 排序、去掉多余空白后序列化，{"city":"北京"} 与 { "city" : "北京" } 命中同一条。
+# 每条结果按工具的 ttl 过期，条目数超过 max_entries 时淘汰最久未使用的
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import RtcMetrics
+
+tool_cache_total = RtcMetrics.registry.counter("rtc_aigc_tool_cache_total", "Tool result cache lookups by tool and result (hit / miss).", ("tool", "result"))
+
+
+def normalize_arguments(arguments):
+    return json.dumps(_normalize(arguments), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return dict((k, _normalize(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ToolResultCache:
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        # (name, 参数) -> (过期时间, 结果)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name, arguments, now=None):
+        if now == None:
+            now = time.monotonic()
+        key = (name, normalize_arguments(arguments))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry != None:
+                self._entries.move_to_end(key)
+        tool_cache_total.inc((name, "miss" if entry == None else "hit"))
+        return entry[1] if entry != None else None
+
+    def put(self, name, arguments, content, ttl, now=None):
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        if now == None:
+            now = time.monotonic()
+        key = (name, normalize_arguments(arguments))
+        with self._lock:
+            self._entries[key] = (now + ttl, content)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,141 @@
+# function calling 工具调度
+# 按函数名注册工具，一条消息中的所有 tool_calls 同时提交到线程池执行，每个工具有自己的超时时间，
+# 结果按完成顺序返回，慢的工具不会拖住已经完成的工具。
+#     dispatcher = ToolDispatcher(workers=16, default_timeout=3.0)
+#
+#     @dispatcher.tool("get_current_weather", timeout=2.0)
+#     def get_current_weather(arguments):
+#         return "..."
+#
+# 工具收到解析后的 arguments(dict)，返回字符串，其它类型会序列化成 json。async def 定义的工具在工作线程中用 asyncio.run 执行。
+# 注册时 cache_ttl > 0 的工具，成功结果在 cache 中保存 cache_ttl 秒，相同参数的调用直接返回缓存结果
+import asyncio
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import RtcLog
+import RtcMetrics
+
+tool_calls_total = RtcMetrics.registry.counter("rtc_aigc_tool_calls_total", "Tool calls by tool and result.", ("tool", "result"))
+tool_seconds = RtcMetrics.registry.histogram("rtc_aigc_tool_seconds", "Tool execution time.", ("tool",))
+
+
+class Tool:
+    __slots__ = ("name", "handler", "timeout", "cache_ttl")
+
+    def __init__(self, name, handler, timeout, cache_ttl=0):
+        self.name = name
+        self.handler = handler
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+
+
+class ToolDispatcher:
+
+    def __init__(self, workers=16, default_timeout=3.0, cache=None):
+        self.default_timeout = default_timeout
+        self.cache = cache
+        self._tools = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rtc-tool")
+
+    def register(self, name, handler, timeout=None, cache_ttl=0):
+        self._tools[name] = Tool(name, handler, timeout if timeout != None else self.default_timeout, cache_ttl)
+
+    # 装饰器形式的 register
+    def tool(self, name, timeout=None, cache_ttl=0):
+        def decorator(handler):
+            self.register(name, handler, timeout, cache_ttl)
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    # 执行 tool_calls，按完成顺序逐个产出 (tool_call_id, content)
+    # 未注册的工具、参数错误、异常和超时都会产出一条错误说明，让大模型知道工具没有结果
+    def run(self, tool_calls):
+        started = time.monotonic()
+        immediate = []
+        pending = {}
+        for tool_call in tool_calls:
+            if not isinstance(tool_call, dict) or "id" not in tool_call:
+                continue
+            function = tool_call.get("function")
+            name = function.get("name") if isinstance(function, dict) else None
+            tool = self._tools.get(name)
+            if tool == None:
+                tool_calls_total.inc(("unknown", "unknown"))
+                immediate.append((tool_call["id"], "tool %s is not available" % name))
+                continue
+            arguments = parse_arguments(function.get("arguments"))
+            if arguments == None:
+                tool_calls_total.inc((tool.name, "bad_arguments"))
+                immediate.append((tool_call["id"], "tool %s got invalid arguments" % name))
+                continue
+            if tool.cache_ttl > 0 and self.cache != None:
+                content = self.cache.get(tool.name, arguments)
+                if content != None:
+                    immediate.append((tool_call["id"], content))
+                    continue
+            future = self._executor.submit(self.invoke, tool, arguments)
+            pending[future] = (tool_call["id"], tool, arguments, started + tool.timeout)
+
+        for result in immediate:
+            yield result
+
+        while pending:
+            timeout = max(0, min(deadline for _, _, _, deadline in pending.values()) - time.monotonic())
+            done, _ = wait(pending, timeout, FIRST_COMPLETED)
+            for future in done:
+                tool_call_id, tool, arguments, _ = pending.pop(future)
+                yield (tool_call_id, self.get_content(future, tool, arguments))
+            now = time.monotonic()
+            for future, (tool_call_id, tool, _, deadline) in list(pending.items()):
+                if deadline <= now and not future.done():
+                    # 已经开始执行的工具无法中断，结果直接丢弃
+                    future.cancel()
+                    del pending[future]
+                    tool_calls_total.inc((tool.name, "timeout"))
+                    RtcLog.warning("tool_timeout", tool=tool.name, timeout=tool.timeout)
+                    yield (tool_call_id, "tool %s timed out" % tool.name)
+
+    def invoke(self, tool, arguments):
+        begin = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(tool.handler):
+                return asyncio.run(tool.handler(arguments))
+            return tool.handler(arguments)
+        finally:
+            tool_seconds.observe(time.perf_counter() - begin, (tool.name,))
+
+    def get_content(self, future, tool, arguments):
+        try:
+            content = future.result()
+        except Exception as e:
+            tool_calls_total.inc((tool.name, "error"))
+            RtcLog.exception("tool_error", tool=tool.name)
+            return "tool %s failed: %s" % (tool.name, e)
+        tool_calls_total.inc((tool.name, "ok"))
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        if tool.cache_ttl > 0 and self.cache != None:
+            self.cache.put(tool.name, arguments, content, tool.cache_ttl)
+        return content
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# arguments 是 json 字符串(也兼容已经解析好的 dict)，解析失败或不是对象时返回 None
+def parse_arguments(arguments):
+    if arguments == None or arguments == "":
+        return {}
+    if isinstance(arguments, dict):
+        return arguments
+    try:
+        arguments = json.loads(arguments)
+    except (TypeError, ValueError):
+        return None
+    return arguments if isinstance(arguments, dict) else None
@@ -0,0 +1,105 @@
+# StartVoiceChat 请求体模板
+# 请求体中除了 AppId / RoomId / UserId 以外的 config 部分只由 (bot_id, voice_id) 决定，
+# 每个 (bot_id, voice_id) 只序列化一次，之后每次 start 只拼接 AppId / RoomId / UserId，
+# 结果与 json.dumps 完整请求体完全一致。最近使用的 profile 保存在 LRU 中
+import json
+import threading
+from collections import OrderedDict
+
+from RtcAigcConfig import ASR_APP_ID, TTS_APP_ID
+
+
+# 参考 https://www.volcengine.com/docs/6348/1316243
+def build_voice_chat_config(bot_id, voice_id):
+    return {
+        #  "BotName" : "",                                       # 非必填，RTC智能体用户id 
+        "IntterruptMode" : 0,                                    # 非必填，智能体对话打断模式。 0: 智能体语音可以被用户语音打断 1: 不能被用户语音打断
+        "ASRConfig" : {
+            "AppId" : ASR_APP_ID,                                # ASR App ID
+            "Cluster" : "volcengine_streaming_common",           # ASR Cluster ID, 默认是通用的 cluster id "volcengine_streaming_common"
+        },
+        "TTSConfig" : {
+            "IgnoreBracketText" : [1, 2, 3, 4, 5],               # 非必填， 过滤大模型生成的文本中符号 1:"（）" 2:"()", 3:"【】", 4:"[]", 5:"{}".默认不过滤
+            "Provider" : "volcano",                              # TTS 服务供应商
+            "ProviderParams" : {
+                "app" : {
+                    "appid" : TTS_APP_ID,                        # TTS App ID
+                    "cluster" : "volcano_tts"                    # 非必填， TTS Cluster ID. default "volcano_tts"
+                },
+                "audio" : {
+                    "voice_type" : voice_id,                     # 非必填，音色类型
+                    "speed_ratio" : 1.0,                         # 非必填，语速，默认 1.0
+                    "volume_ratio" : 1.0,                        # 非必填，音量，默认 1.0
+                    "pitch_ratio" : 1.0,                         # 非必填，音调，默认 1.0
+                }
+            }
+        },
+        "LLMConfig" : {
+            "Mode": "ArkV3",                                     # 模型类型
+            "EndPointId": bot_id,                                # 推理接入点。使用方舟大模型时必填。
+            "MaxTokens": 1024,                                   # 非必填，输出文本的最大token数，默认 1024
+            "Temperature": 0.1,                                  # 非必填，用于控制生成文本的随机性和创造性，值越大随机性越高。取值范围为（0,1]，默认值为 0.1
+            "TopP": 0.3,                                         # 非必填，用于控制输出tokens的多样性，值越大输出的tokens类型越丰富。取值范围为（0,1]，默认值为 0.3
+            "SystemMessages": [                                  # 非必填，大模型 System 角色预设指令，可用于控制模型输出。
+                "你是小宁，性格幽默又善解人意。你在表达时需简明扼要，有自己的观点。"
+            ],
+            "UserMessages": [                                    # 非必填，大模型 User 角色预设 Prompt，可用于增强模型的回复质量，模型回复时会参考此处内容。
+                "user:\"你是谁\"",
+                "assistant:\"我是问答助手\"",
+                "user:\"你能干什么\"",
+                "user:\"我能回答问题\""
+            ],
+            "HistoryLength": 3,                                  # 非必填，大模型上下文长度，默认 3。
+            "WelcomeSpeech": "你好有什么可以帮到你的吗",            # 非必填，智能体启动后的欢迎词。
+        },
+        "SubtitleConfig" : {
+            "DisableRTSSubtitle" : True,                        # 非必填，是否关闭房间内字幕回调，默认 false
+        },
+    }
+
+
+# UpdateVoiceChat 打断请求体，与 json.dumps({"AppId", "RoomId", "UserId", "Command"}) 完全一致
+def render_interrupt(app_id, room_id, user_id):
+    return ('{"AppId": ' + json.dumps(app_id) +
+            ', "RoomId": ' + json.dumps(room_id) +
+            ', "UserId": ' + json.dumps(user_id) +
+            ', "Command": "interrupt"}')
+
+
+class StartVoiceChatTemplates:
+
+    def __init__(self, max_profiles=64):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits" : 0,
+            "misses" : 0,
+        }
+
+    # 返回 StartVoiceChat 请求体 json 字符串
+    def render(self, app_id, room_id, user_id, bot_id, voice_id):
+        return ('{"AppId": ' + json.dumps(app_id) +
+                ', "RoomId": ' + json.dumps(room_id) +
+                ', "UserId": ' + json.dumps(user_id) +
+                ', "config": ' + self.get_config_json(bot_id, voice_id) + '}')
+
+    def get_config_json(self, bot_id, voice_id):
+        key = (bot_id, voice_id)
+        if not isinstance(bot_id, str) or not isinstance(voice_id, str):
+            return json.dumps(build_voice_chat_config(bot_id, voice_id))
+        with self._lock:
+            config_json = self._profiles.get(key)
+            if config_json != None:
+                self._profiles.move_to_end(key)
+                self.stats["hits"] += 1
+                return config_json
+            self.stats["misses"] += 1
+
+        config_json = json.dumps(build_voice_chat_config(bot_id, voice_id))
+        with self._lock:
+            self._profiles[key] = config_json
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return config_json
@@ -0,0 +1,58 @@
+# 请求签名耗时对比：每次重新计算四级 HMAC 派生密钥 vs 按天缓存派生密钥
+# 用法: python benchmarks/bench_signing.py [次数]
+import datetime
+import sys
+import timeit
+
+import repo_path
+import RtcApiRequester
+
+AK = "AKLTbenchmarkaccesskey"
+SK = "benchmarksecretkeybenchmarksecretkey"
+HOST = "rtc.volcengineapi.com"
+QUERY = "Action=StartVoiceChat&Version=2024-06-01"
+BODY = '{"AppId": "66bb6632f55d550120fb5c94", "RoomId": "G711Abf410694b3a34a3aa980b6e85613200d", "UserId": "userbf410694b3a34a3aa980b6e85613200d"}'
+
+
+# 缓存前的签名方式：每个请求都从 SK 开始重新计算整条 HMAC 链
+def sign_uncached(now):
+    x_content_sha256 = RtcApiRequester.hash_sha256(BODY)
+    x_date = now.strftime("%Y%m%dT%H%M%SZ")
+    signed_headers_vec = (
+        ("content-type", "application/json"),
+        ("host", HOST),
+        ("x-content-sha256", x_content_sha256),
+        ("x-date", x_date)
+    )
+    canonical_headers = "\n".join((":".join(x) for x in signed_headers_vec)) + "\n"
+    signed_headers = ";".join((x[0] for x in signed_headers_vec))
+    canonical_request = "POST\n/\n" + QUERY + "\n" + canonical_headers + "\n" + signed_headers + "\n" + x_content_sha256
+    credential_scope = x_date[0:8] + "/cn-north-1/rtc/request"
+    string_to_sign = "HMAC-SHA256" + "\n" + x_date + "\n" + credential_scope + "\n" + RtcApiRequester.hash_sha256(canonical_request)
+    hmac_contents = credential_scope.split("/")
+    hmac_contents.append(string_to_sign)
+    signature = SK.encode("utf-8")
+    for hmac_content in hmac_contents:
+        signature = RtcApiRequester.hmac_sha256(signature, hmac_content)
+    return "HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, Signature=%s" % (AK, credential_scope, signed_headers, signature.hex())
+
+
+def sign_cached(now):
+    return RtcApiRequester.get_request_signer(HOST, "POST", "/", QUERY, AK, SK).sign(BODY, now)["Authorization"]
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    now = datetime.datetime.utcnow()
+    if sign_uncached(now) != sign_cached(now):
+        print("signature mismatch between cached and uncached signing")
+        return 1
+
+    for name, func in (("uncached", sign_uncached), ("cached", sign_cached)):
+        seconds = min(timeit.repeat(lambda: func(now), number=number, repeat=3))
+        print("%-10s %8.2f us/request  %10.0f requests/s" % (name, seconds / number * 1e6, number / seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# /startvoicechat、/updatevoicechat(interrupt / function)、/stopvoicechat 端到端压测
+# 每个并发用户循环执行一次完整会话: start -> interrupt x N -> function -> stop，
+# 统计每个接口的 p50/p95/p99 延迟、吞吐和错误分布，结果写入 json 文件，便于不同版本之间对比。
+#
+# 默认在进程内启动 RtcApiMockServer 和 RtcAigcHTTPRequestHandler 服务，不访问真实的 RTC OpenAPI:
+#     python benchmarks/bench_voicechat.py --concurrency 32 --duration 30 --mode pool --upstream-latency-ms 80
+# 压测已经运行的服务:
+#     python benchmarks/bench_voicechat.py --url http://127.0.0.1:8080 --authorization af78e30xxxx
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from repo_path import REPO_DIR
+
+BENCH_AK = "AKLTbenchmark"
+BENCH_SK = "benchmarksecret"
+BENCH_APP_ID = "66bb6632f55d550120fb5c94"
+BENCH_APP_KEY = "benchmarkappkey"
+
+FUNCTION_MESSAGE = json.dumps({
+    "subscriber_user_id" : "",
+    "tool_calls" : [
+        {
+            "function" : {
+                "arguments" : "{\"location\": \"\\u5317\\u4eac\\u5e02\"}",
+                "name" : "get_current_weather"
+            },
+            "id" : "call_benchmark",
+            "type" : "function"
+        }
+    ]
+})
+
+
+# 在进程内启动替身 OpenAPI 和待测服务，返回 (服务地址, Authorization, mock, 关闭函数)
+def start_local_servers(args):
+    import RtcAigcConfig
+    RtcAigcConfig.AK = BENCH_AK
+    RtcAigcConfig.SK = BENCH_SK
+    RtcAigcConfig.RTC_APP_ID = BENCH_APP_ID
+    RtcAigcConfig.RTC_APP_KEY = BENCH_APP_KEY
+    RtcAigcConfig.RTC_API_SCHEME = "http"
+    RtcAigcConfig.RATE_LIMIT_ENABLED = args.rate_limit
+
+    import RtcApiMockServer
+    mock = RtcApiMockServer.MockRtcApi(BENCH_AK, BENCH_SK, args.upstream_latency_ms / 1000.0, args.upstream_jitter_ms / 1000.0,
+                                       args.upstream_error_rate, args.upstream_qps)
+    mock_server = RtcApiMockServer.MockRtcApiServer(("127.0.0.1", 0), mock)
+    RtcAigcConfig.RTC_API_HOST = "127.0.0.1:%d" % mock_server.server_address[1]
+
+    # 配置修改完成后再导入服务端模块
+    import Esp32_Bytedance_RTC
+    import RtcAigcServer
+    Esp32_Bytedance_RTC.RtcAigcHTTPRequestHandler.log_message = lambda *a: None
+    server = RtcAigcServer.create_server(("127.0.0.1", 0), Esp32_Bytedance_RTC.RtcAigcHTTPRequestHandler, args.mode, args.workers, args.max_in_flight)
+
+    threads = [
+        threading.Thread(target=mock_server.serve_forever, daemon=True),
+        threading.Thread(target=server.serve_forever, daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        mock_server.shutdown()
+        mock_server.server_close()
+
+    return ("http://127.0.0.1:%d" % server.server_address[1], "af78e30" + BENCH_APP_ID, mock, stop)
+
+
+class Recorder:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, label, seconds, status, msg):
+        with self._lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            if status not in (200, 202):
+                key = "%s %s %s" % (label, status, msg)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def post(url, authorization, path, obj, timeout):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        body = json.dumps(obj)
+        conn.request("POST", path, body, {"Content-Type" : "application/json", "Authorization" : authorization})
+        response = conn.getresponse()
+        data = response.read()
+        try:
+            resp_obj = json.loads(data)
+        except ValueError:
+            resp_obj = {}
+        return (response.status, resp_obj)
+    finally:
+        conn.close()
+
+
+def run_session(args, recorder):
+    def call(label, path, obj):
+        begin = time.perf_counter()
+        try:
+            status, resp_obj = post(args.url, args.authorization, path, obj, args.timeout)
+            msg = resp_obj.get("msg", "")
+        except Exception as e:
+            status, resp_obj, msg = "exception", {}, type(e).__name__
+        recorder.record(label, time.perf_counter() - begin, status, msg)
+        return (status, resp_obj)
+
+    status, resp_obj = call("start", "/startvoicechat", {"device_id" : "bench-" + uuid.uuid4().hex})
+    if status != 200 or "data" not in resp_obj:
+        return
+    room = resp_obj["data"]
+    ids = {
+        "app_id" : room["app_id"],
+        "room_id" : room["room_id"],
+        "uid" : room["uid"]
+    }
+    for _ in range(args.interrupts):
+        call("update_interrupt", "/updatevoicechat", dict(ids, command="interrupt"))
+    if args.functions:
+        call("update_function", "/updatevoicechat", dict(ids, command="function", message=FUNCTION_MESSAGE))
+    call("stop", "/stopvoicechat", ids)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    endpoints = {}
+    total = 0
+    for label, values in sorted(latencies.items()):
+        values = sorted(values)
+        total += len(values)
+        failed = sum(count for key, count in errors.items() if key.startswith(label + " "))
+        endpoints[label] = {
+            "count" : len(values),
+            "errors" : failed,
+            "throughput" : len(values) / elapsed,
+            "mean_ms" : sum(values) / len(values) * 1000,
+            "p50_ms" : percentile(values, 50) * 1000,
+            "p95_ms" : percentile(values, 95) * 1000,
+            "p99_ms" : percentile(values, 99) * 1000,
+            "max_ms" : values[-1] * 1000,
+        }
+    return {
+        "elapsed_s" : elapsed,
+        "requests" : total,
+        "throughput" : total / elapsed if elapsed > 0 else 0,
+        "error_count" : sum(errors.values()),
+        "endpoints" : endpoints,
+        "errors" : errors,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end benchmark of the voicechat endpoints")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one in-process")
+    parser.add_argument("--authorization", help="Authorization header, required with --url")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--sessions", type=int, default=0, help="stop after this many sessions, 0 means run for --duration")
+    parser.add_argument("--interrupts", type=int, default=2, help="interrupt updates per session")
+    parser.add_argument("--functions", type=int, default=1, help="send a function update per session (0/1)")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--mode", default="pool", help="server mode for the in-process server")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--max-in-flight", type=int, default=0)
+    parser.add_argument("--upstream-latency-ms", type=float, default=50)
+    parser.add_argument("--upstream-jitter-ms", type=float, default=20)
+    parser.add_argument("--upstream-error-rate", type=float, default=0)
+    parser.add_argument("--upstream-qps", type=int, default=0)
+    parser.add_argument("--rate-limit", action="store_true", help="keep the in-process server's per-device / per-app rate limits on")
+    parser.add_argument("--output", default=os.path.join(REPO_DIR, "benchmarks", "bench_voicechat.json"), help="machine-readable result file")
+    args = parser.parse_args()
+
+    mock = None
+    stop = None
+    if args.url == None:
+        args.url, args.authorization, mock, stop = start_local_servers(args)
+    elif args.authorization == None:
+        parser.error("--authorization is required with --url")
+
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    sessions = [0]
+    sessions_lock = threading.Lock()
+
+    def worker():
+        while time.monotonic() < deadline:
+            if args.sessions > 0:
+                with sessions_lock:
+                    if sessions[0] >= args.sessions:
+                        return
+                    sessions[0] += 1
+            run_session(args, recorder)
+
+    begin = time.perf_counter()
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - begin
+
+    result = summarize(recorder.latencies, recorder.errors, elapsed)
+    result["revision"] = git_revision()
+    result["timestamp"] = int(time.time())
+    result["config"] = dict((k, v) for k, v in vars(args).items() if k != "authorization")
+    if mock != None:
+        result["upstream"] = mock.snapshot()
+    if stop != None:
+        stop()
+
+    print("%-18s %8s %7s %9s %9s %9s %9s" % ("endpoint", "count", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+    for label, s in result["endpoints"].items():
+        print("%-18s %8d %7d %9.1f %9.2f %9.2f %9.2f" % (label, s["count"], s["errors"], s["throughput"], s["p50_ms"], s["p95_ms"], s["p99_ms"]))
+    print("total %d requests in %.1fs, %.1f req/s, %d errors" % (result["requests"], elapsed, result["throughput"], result["error_count"]))
+    for key, count in sorted(result["errors"].items()):
+        print("  %6d  %s" % (count, key))
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print("results written to", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+# 命令行脚本(benchmarks 下的压测脚本、RtcApiMockServer)在导入仓库模块前 import 本模块。
+# 仓库里给 ESP32 用的 threading.py / uuid.py 与标准库同名，仓库目录在 sys.path 前面时会覆盖标准库，
+# 这里把仓库目录移到(或追加到) sys.path 末尾
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != REPO_DIR]
+sys.path.append(REPO_DIR)